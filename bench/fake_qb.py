@@ -0,0 +1,377 @@
+"""
+模拟 qBittorrent WebUI API 及 TG 接口, 用于压测
+"""
+import argparse
+import gzip
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+GB = 1024 * 1024 * 1024
+MB = 1024 * 1024
+# 种子状态分布
+STATE_WEIGHTS = [
+    ('uploading', 30),
+    ('stalledUP', 38),
+    ('downloading', 12),
+    ('stalledDL', 8),
+    ('pausedDL', 8),
+    ('error', 1),
+    ('forcedUP', 2),
+    ('forcedDL', 1),
+]
+# 模拟站点 分类 => 域名
+SITES = {
+    'A': 'a.bench',
+    'B': 'b.bench',
+    'C': 'c.bench',
+    'D': 'd.bench',
+}
+# 模拟制作组
+GROUPS = ['GRPA', 'GRPB', 'GRPC', 'WEB', 'FRDS', 'CMCT', 'HDH', 'OTHER']
+# 模拟的 SID
+SID = 'bench'
+
+
+# 生成一个种子
+def make_torrent(index=None, rnd=None, now=None):
+    states = [row[0] for row in STATE_WEIGHTS]
+    weights = [row[1] for row in STATE_WEIGHTS]
+    state = rnd.choices(states, weights=weights)[0]
+    category = rnd.choice(list(SITES.keys()))
+    total_size = rnd.randint(1, 80) * GB + rnd.randint(0, 1023) * MB
+    added_on = now - rnd.randint(60, 30 * 24 * 3600)
+    if state in ['uploading', 'stalledUP', 'forcedUP']:
+        progress = 1.0
+    elif state == 'pausedDL':
+        progress = 0.0
+    else:
+        progress = round(rnd.random(), 4)
+    downloaded = int(total_size * progress)
+    uploaded = int(downloaded * rnd.random() * 4)
+    upspeed = rnd.choice([0, rnd.randint(1, 512) * 1024, rnd.randint(1, 20) * MB]) if state not in ['pausedDL', 'error'] else 0
+    dlspeed = rnd.randint(0, 50) * MB if state in ['downloading', 'forcedDL'] else 0
+    torrent_hash = '%040x' % rnd.getrandbits(160)
+    return {
+        'hash': torrent_hash,
+        'name': f'Bench.Torrent.{index}.2160p.WEB-DL-{rnd.choice(GROUPS)}',
+        'category': category,
+        'state': state,
+        'size': total_size,
+        'total_size': total_size,
+        'completed': downloaded,
+        'progress': progress,
+        'uploaded': uploaded,
+        'downloaded': downloaded,
+        'upspeed': upspeed,
+        'dlspeed': dlspeed,
+        'ratio': round(uploaded / downloaded, 4) if downloaded > 0 else 0,
+        'added_on': added_on,
+        'completion_on': added_on + rnd.randint(60, 3600) if progress >= 1 else 0,
+        'seeding_time': rnd.randint(0, 30 * 24 * 3600) if progress >= 1 else 0,
+        'num_incomplete': rnd.randint(0, 200),
+        'num_leechs': rnd.randint(0, 50),
+        'tracker': f'https://tracker.{SITES[category]}/announce',
+        'magnet_uri': '',
+    }
+
+
+# 生成种子的文件列表
+def make_files(item=None, seed=0):
+    rnd = random.Random(item['hash'] + str(seed))
+    number = rnd.randint(1, 12)
+    weights = [rnd.random() + 0.1 for _ in range(number)]
+    total = sum(weights)
+    files = []
+    for index, weight in enumerate(weights):
+        files.append({
+            'index': index,
+            'name': f"{item['name']}/E{index + 1:02d}.mkv",
+            'size': int(item['total_size'] * weight / total),
+            'priority': 1,
+            'progress': item['progress'],
+        })
+    return files
+
+
+# 生成种子集合
+def make_fleet(number=1000, seed=1):
+    rnd = random.Random(seed)
+    now = int(time.time())
+    fleet = {}
+    for index in range(number):
+        item = make_torrent(index=index, rnd=rnd, now=now)
+        fleet[item['hash']] = item
+    return fleet
+
+
+class FakeState:
+    # 种子数
+    number = 0
+    # 随机种子
+    seed = 1
+    # 每个请求的延迟 (秒)
+    latency = 0
+    # 种子表 hash => 种子数据
+    torrents = {}
+    # 种子文件 hash => 文件列表
+    files = {}
+    # 种子最后修改的版本 hash => rid
+    versions = {}
+    # 已删除的种子 hash => rid
+    removed = {}
+    # 当前版本
+    rid = 0
+    # 接口调用次数
+    calls = {}
+    # 收到的TG消息数
+    messages = 0
+
+    '''
+    实例化
+    :param number 种子数
+    :param seed 随机种子
+    :param latency 每个请求的延迟 (秒)
+    '''
+    def __init__(self, number=1000, seed=1, latency=0):
+        self.number = number
+        self.seed = seed
+        self.latency = latency
+        self.lock = threading.RLock()
+        self.reset()
+
+    '''
+    重新生成种子集合
+    '''
+    def reset(self):
+        with self.lock:
+            self.torrents = make_fleet(number=self.number, seed=self.seed)
+            self.files = {}
+            self.rid += 1
+            self.versions = dict([(torrent_hash, self.rid) for torrent_hash in self.torrents])
+            self.removed = {}
+            self.calls = {}
+            self.messages = 0
+        return self
+
+    '''
+    种子已修改
+    :param torrent_hash 种子HASH
+    '''
+    def touch(self, torrent_hash=None):
+        self.rid += 1
+        self.versions[torrent_hash] = self.rid
+
+    '''
+    增量同步
+    :param rid 上次同步的版本
+    '''
+    def maindata(self, rid=0):
+        data = {'rid': self.rid, 'server_state': {'free_space_on_disk': 1024 * GB}}
+        # 版本不存在时全量同步
+        if rid <= 0 or rid > self.rid:
+            data['full_update'] = True
+            data['torrents'] = self.torrents
+            return data
+        data['torrents'] = dict([(torrent_hash, self.torrents[torrent_hash])
+                                 for torrent_hash, version in self.versions.items() if version > rid])
+        data['torrents_removed'] = [torrent_hash for torrent_hash, version in self.removed.items() if version > rid]
+        return data
+
+    '''
+    种子的文件列表
+    :param torrent_hash 种子HASH
+    '''
+    def torrent_files(self, torrent_hash=None):
+        files = self.files.get(torrent_hash)
+        if files is None:
+            files = make_files(item=self.torrents[torrent_hash], seed=self.seed)
+            self.files[torrent_hash] = files
+        return files
+
+    '''
+    处理接口请求
+    :param path 接口地址
+    :param params 请求参数
+    :param cookie 请求的cookie
+    '''
+    def handle(self, path=None, params=None, cookie=None):
+        if path == '/fake/reset':
+            self.reset()
+            return 200, {}, 'Ok.'
+
+        with self.lock:
+            self.calls[path] = self.calls.get(path, 0) + 1
+
+            # TG 接口
+            if path.startswith('/bot') and path.endswith('/sendMessage'):
+                self.messages += 1
+                return 200, {}, {'ok': True, 'result': {}}
+
+            if path == '/fake/stats':
+                return 200, {}, {'calls': self.calls, 'messages': self.messages, 'torrents': len(self.torrents), 'rid': self.rid}
+
+            if path == '/api/v2/auth/login':
+                return 200, {'set-cookie': f'SID={SID}; HttpOnly; path=/'}, 'Ok.'
+            if cookie != f'SID={SID}':
+                return 403, {}, 'Forbidden'
+
+            hashes = params.get('hashes', '').split('|') if params.get('hashes', '') != '' else []
+            if path == '/api/v2/torrents/info':
+                rows = list(self.torrents.values())
+                if len(hashes) > 0:
+                    rows = [self.torrents[row] for row in hashes if row in self.torrents]
+                if params.get('filter') is not None:
+                    rows = self.filter_rows(rows=rows, filter_name=params['filter'])
+                return 200, {}, rows
+            if path == '/api/v2/sync/maindata':
+                return 200, {}, self.maindata(rid=int(params.get('rid') or 0))
+            if path == '/api/v2/torrents/files':
+                if params.get('hash') not in self.torrents:
+                    return 404, {}, 'Not Found'
+                return 200, {}, self.torrent_files(torrent_hash=params['hash'])
+            if path == '/api/v2/torrents/filePrio':
+                if params.get('hash') not in self.torrents:
+                    return 404, {}, 'Not Found'
+                files = self.torrent_files(torrent_hash=params['hash'])
+                indexes = [int(row) for row in params.get('id', '').split('|') if row != '']
+                for row in files:
+                    if row['index'] in indexes:
+                        row['priority'] = int(params.get('priority', 0))
+                item = self.torrents[params['hash']]
+                item['size'] = sum([row['size'] for row in files if row['priority'] > 0])
+                self.touch(torrent_hash=params['hash'])
+                return 200, {}, ''
+            if path == '/api/v2/torrents/delete':
+                for torrent_hash in hashes:
+                    if self.torrents.pop(torrent_hash, None) is not None:
+                        self.versions.pop(torrent_hash, None)
+                        self.files.pop(torrent_hash, None)
+                        self.rid += 1
+                        self.removed[torrent_hash] = self.rid
+                return 200, {}, ''
+            if path in ['/api/v2/torrents/pause', '/api/v2/torrents/resume']:
+                for torrent_hash in hashes:
+                    item = self.torrents.get(torrent_hash)
+                    if item is None:
+                        continue
+                    if path.endswith('pause'):
+                        item['state'] = 'pausedDL' if item['progress'] < 1 else 'pausedUP'
+                    else:
+                        item['state'] = 'downloading' if item['progress'] < 1 else 'stalledUP'
+                    self.touch(torrent_hash=torrent_hash)
+                return 200, {}, ''
+            if path == '/api/v2/torrents/reannounce':
+                return 200, {}, ''
+            return 404, {}, 'Not Found'
+
+    '''
+    按状态过滤种子
+    :param rows 种子列表
+    :param filter_name 过滤条件
+    '''
+    def filter_rows(self, rows=None, filter_name=None):
+        filters = {
+            'downloading': ['downloading', 'stalledDL', 'forcedDL', 'pausedDL', 'metaDL', 'queuedDL', 'checkingDL'],
+            'seeding': ['uploading', 'stalledUP', 'forcedUP', 'queuedUP', 'checkingUP'],
+            'completed': ['uploading', 'stalledUP', 'forcedUP', 'pausedUP', 'queuedUP', 'checkingUP'],
+            'paused': ['pausedDL', 'pausedUP'],
+            'active': ['uploading', 'downloading', 'forcedUP', 'forcedDL'],
+            'errored': ['error', 'missingFiles'],
+        }
+        states = filters.get(filter_name)
+        if states is None:
+            return rows
+        return [row for row in rows if row['state'] in states]
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch(body='')
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.dispatch(body=self.rfile.read(length).decode('utf-8'))
+
+    def dispatch(self, body=None):
+        url = urlsplit(self.path)
+        params = dict([(key, value[0]) for key, value in parse_qs(url.query).items()])
+        params.update(dict([(key, value[0]) for key, value in parse_qs(body).items()]))
+        state = self.server.state
+        if state.latency > 0:
+            time.sleep(state.latency)
+        # 序列化时种子表不能被其他请求修改
+        with state.lock:
+            code, headers, content = state.handle(path=url.path, params=params, cookie=self.headers.get('Cookie'))
+            if not isinstance(content, str):
+                content = json.dumps(content)
+        data = content.encode('utf-8')
+        self.send_response(code)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        # 和 qBittorrent 一样按 Accept-Encoding 压缩返回内容
+        if 'gzip' in (self.headers.get('Accept-Encoding') or '') and len(data) > 1024:
+            data = gzip.compress(data, compresslevel=6)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Type', 'application/json' if content[:1] in ['{', '['] else 'text/plain')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    '''
+    实例化
+    :param port 端口, 0 为随机端口
+    :param number 种子数
+    :param seed 随机种子
+    :param latency 每个请求的延迟 (秒)
+    '''
+    def __init__(self, port=0, number=1000, seed=1, latency=0):
+        super().__init__(('127.0.0.1', port), Handler)
+        self.state = FakeState(number=number, seed=seed, latency=latency)
+        self.thread = None
+
+    '''
+    接口地址
+    '''
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    '''
+    后台启动
+    '''
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    '''
+    停止
+    '''
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        return self
+
+
+if __name__ == '__main__':
+    ARGP = argparse.ArgumentParser(description='模拟 qBittorrent WebUI API 及 TG 接口')
+    ARGP.add_argument('--port', type=int, default=8080, help='监听端口')
+    ARGP.add_argument('--number', type=int, default=1000, help='种子数')
+    ARGP.add_argument('--seed', type=int, default=1, help='随机种子')
+    ARGP.add_argument('--latency', type=float, default=0, help='每个请求的延迟 (秒)')
+    argp = ARGP.parse_args()
+    server = FakeServer(port=argp.port, number=argp.number, seed=argp.seed, latency=argp.latency)
+    print(f'{server.url()} 种子数: {argp.number}')
+    server.serve_forever()
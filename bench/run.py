@@ -0,0 +1,243 @@
+"""
+端到端压测, 在临时目录中运行, 不影响正式数据
+python bench/run.py --scales 1000,10000,50000 --latency 0.005
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_qb import FakeServer, SITES
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 运行时生成的数据目录, 每轮压测前清空
+DATA_DIRS = ['sync', 'cookies', 'torrents', 'events', 'logs', 'monitor', 'snapshots', 'replay', 'cache',
+             'decisions', 'stats', 'notify']
+# 压测下载器名称
+QB_NAME = 'BENCH'
+
+
+# 复制代码到临时目录
+def prepare(workdir=None):
+    shutil.copy(ROOT + '/main.py', workdir + '/main.py')
+    shutil.copytree(ROOT + '/tool', workdir + '/tool', ignore=shutil.ignore_patterns('__pycache__'))
+    return workdir
+
+
+# 清空运行数据
+def clean(workdir=None, dirs=None):
+    # 同时丢弃未落盘的文件
+    from tool.file import remove_dir
+    for dirname in dirs if dirs is not None else DATA_DIRS:
+        remove_dir(dirname=workdir + '/' + dirname)
+
+
+# 压测配置
+def bench_env(url=None, number=None):
+    env = {
+        'ALL_DOWNLOADERS': QB_NAME,
+        QB_NAME + '_URL': url,
+        QB_NAME + '_USERNAME': 'admin',
+        QB_NAME + '_PASSWORD': 'admin',
+        # 平均每个种子约40GB, 留出少量剩余空间
+        QB_NAME + '_DISK_SPACE': str(number * 42),
+        QB_NAME + '_LESS_DOSK_SPACE': '100',
+        QB_NAME + '_LIMIT_ACTIVE_TORRENT_NUM': '50',
+        QB_NAME + '_LIMIT_TORRENT_DOWNLOAD_SIZE': '100',
+        # 不发送删种通知, 耗时只统计种子处理, 不含等待TG消息发送
+        QB_NAME + '_TG_TOKEN': '',
+        QB_NAME + '_TG_CHAT_ID': '',
+        'MONITOR_TG_TOKEN': 'bench',
+        'MONITOR_TG_CHAT_ID': '1',
+        'TG_API_URL': url,
+        'TORRENT_SPLIT_DOMAIN': 'a.bench,b.bench',
+        'TORRENT_SPLIT_FILTER_MAX_SIZE': '100',
+        'TORRENT_SPLIT_FILTER_MIN_SIZE': '0.1',
+        'BLACK_TORRENT_DOMAIN': 'c.bench',
+        'HR_DOMAIN': 'd.bench',
+        'HR_LIMIT_MIN_CHOOSE_SIZE': '10',
+        'ALL_GROUP': 'GRPA,GRPB,FRDS',
+        'A_GROUP': 'GRPA,WEB',
+        'A_INCOMPLETE': '5',
+        'A_LEECHS': '3',
+        'A_LIMIT_MAX_DOWNLOAD_SIZE': '60',
+        'A_LIMIT_MIN_DOWNLOAD_SIZE': '20',
+        'B_GROUP': 'GRPB',
+        'B_LIMIT_MAX_DOWNLOAD_SIZE': '40',
+        'B_SPLIT_SINGLE_FILE': '1',
+        'C_GROUP': 'GRPC',
+        'D_GROUP': 'HDH',
+        'D_HR_GROUP': 'HDH',
+        'D_HR_PROGRESS': '50',
+    }
+    for category, domain in SITES.items():
+        env[category + '_DOMAIN'] = domain
+    return env
+
+
+# 生成删种事件
+def make_events(workdir=None, number=None, days=30, seed=1):
+    rnd = random.Random(seed)
+    now = int(time.time())
+    files = {}
+    for index in range(number):
+        category = rnd.choice(list(SITES.keys()))
+        event_time = now - rnd.randint(0, days * 24 * 3600)
+        date = time.strftime('%Y-%m-%d', time.localtime(event_time))
+        total_size = rnd.randint(1, 80) * 1024 * 1024 * 1024
+        event = {
+            'time': event_time,
+            'date': date,
+            'downloader': QB_NAME,
+            'hash': '%040x' % rnd.getrandbits(160),
+            'name': f'Bench.Event.{index}',
+            'category': category,
+            'domain': SITES[category],
+            'state': 'stalledUP',
+            'total_size': total_size,
+            'size': total_size,
+            'completed': total_size,
+            'uploaded': rnd.randint(0, total_size * 3),
+            'downloaded': total_size,
+            'upspeed': 0,
+            'dlspeed': 0,
+            'ratio': 0,
+            'progress': 1,
+            'added_on': event_time - 3600,
+            'rule': 'bench',
+        }
+        files.setdefault((SITES[category], date), []).append(json.dumps(event) + '\n')
+    for (domain, date), rows in files.items():
+        os.makedirs(workdir + '/events/' + domain, exist_ok=True)
+        with open(workdir + '/events/' + domain + '/' + date + '.jsonl', 'a', encoding='utf-8') as f:
+            f.write(''.join(rows))
+    return number
+
+
+# 耗时统计
+def summary(values=None):
+    return {
+        'runs': len(values),
+        'min': round(min(values), 6),
+        'mean': round(statistics.mean(values), 6),
+        'max': round(max(values), 6),
+    }
+
+
+# 压测一个规模
+def run_scale(workdir=None, number=None, latency=0, repeat=3):
+    from tool.qb import Qb
+    from tool.monitor import Monitor
+    from tool.settings import reload_settings
+
+    server = FakeServer(number=number, latency=latency).start()
+    env = bench_env(url=server.url(), number=number)
+    os.environ.update(env)
+    reload_settings()
+    result = {'torrents': number, 'latency': latency}
+    try:
+        # 完整运行一次 main.py -n, 每次都是冷启动全量同步
+        values = []
+        for _ in range(repeat):
+            server.state.reset()
+            clean(workdir=workdir)
+            start = time.perf_counter()
+            subprocess.run([sys.executable, 'main.py', '-n', QB_NAME], cwd=workdir, env=dict(os.environ),
+                           check=True, stdout=subprocess.DEVNULL)
+            values.append(time.perf_counter() - start)
+        result['main_cycle'] = summary(values=values)
+        result['main_cycle_api_calls'] = dict(server.state.calls)
+
+        # 处理种子
+        values = []
+        for _ in range(repeat):
+            server.state.reset()
+            clean(workdir=workdir)
+            qb = Qb(qb_name=QB_NAME)
+            qb.check_login()
+            qb.get_torrents()
+            start = time.perf_counter()
+            qb.handle_torrents()
+            values.append(time.perf_counter() - start)
+        result['handle_torrents'] = summary(values=values)
+
+        # 低收益种子, 首次调用包含建堆
+        server.state.reset()
+        clean(workdir=workdir)
+        qb = Qb(qb_name=QB_NAME)
+        qb.check_login()
+        qb.get_torrents()
+        first = []
+        values = []
+        for _ in range(repeat):
+            qb.evict = None
+            start = time.perf_counter()
+            qb.get_lower_income_torrent()
+            first.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            qb.get_lower_income_torrent()
+            values.append(time.perf_counter() - start)
+        result['get_lower_income_torrent_first'] = summary(values=first)
+        result['get_lower_income_torrent'] = summary(values=values)
+
+        # 统计监控, 全量重建及增量
+        clean(workdir=workdir)
+        make_events(workdir=workdir, number=number)
+        values = []
+        incremental = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            Monitor().rebuild().analysis_torrent()
+            values.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            Monitor().analysis_torrent()
+            incremental.append(time.perf_counter() - start)
+        result['monitor_rebuild'] = summary(values=values)
+        result['monitor_incremental'] = summary(values=incremental)
+    finally:
+        server.stop()
+    return result
+
+
+if __name__ == '__main__':
+    ARGP = argparse.ArgumentParser(description='端到端压测')
+    ARGP.add_argument('--scales', default='1000,10000,50000', help='种子数, 多个用,隔开')
+    ARGP.add_argument('--latency', type=float, default=0, help='模拟接口延迟 (秒)')
+    ARGP.add_argument('--repeat', type=int, default=3, help='每项重复次数')
+    ARGP.add_argument('--output', default=None, help='结果文件, 默认 bench/results/时间.json')
+    argp = ARGP.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='qb-bench-')
+    prepare(workdir=workdir)
+    sys.path.insert(0, workdir)
+    results = {
+        'time': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': argp.repeat,
+        'scales': [],
+    }
+    try:
+        for scale in [int(row) for row in argp.scales.split(',') if row != '']:
+            print(f'压测 {scale} 个种子 ...')
+            row = run_scale(workdir=workdir, number=scale, latency=argp.latency, repeat=argp.repeat)
+            print(json.dumps(row, ensure_ascii=False))
+            results['scales'].append(row)
+    finally:
+        clean(workdir=workdir)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = argp.output
+    if output is None:
+        os.makedirs(ROOT + '/bench/results', exist_ok=True)
+        output = ROOT + '/bench/results/' + time.strftime('%Y%m%d-%H%M%S', time.localtime()) + '.json'
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=4, ensure_ascii=False)
+    print(f'结果已保存: {output}')
@@ -1,4 +1,5 @@
 import argparse
+import json
 import sys
 import os
 from dotenv import load_dotenv
@@ -6,28 +7,49 @@ from dotenv import load_dotenv
 sys.path.append(os.path.dirname((os.path.dirname(os.path.abspath(__file__)))))
 from tool.qb import Qb
 from tool.monitor import Monitor
+from tool.daemon import Daemon
+from tool.file import flush_files
+from tool.notify import flush_notify, load_notify
+from tool.metrics import export_metrics
+from tool.replay import Replay
+from tool.settings import get_settings
 
 qb_name = None
+daemon = False
+rebuild = False
+dry_run = False
+replay = False
 
 
 # 解析参数
 def args():
-    global qb_name
+    global qb_name, daemon, rebuild, dry_run, replay
     ARGP = argparse.ArgumentParser(
         description='这是一个自动化种子管理',
         add_help=False,
         formatter_class=argparse.RawTextHelpFormatter,
     )
     ARGP.add_argument('-h', '--help', action='help', help='这是提示信息')
-    ARGP.add_argument('-n', '--qb_name', required=False, help='下载器的名称. .env文件配置的前缀名称')
+    ARGP.add_argument('-n', '--qb_name', required=False, help='下载器的名称. .env文件配置的前缀名称, 多个用,隔开并发处理')
+    ARGP.add_argument('-d', '--daemon', action='store_true', help='常驻运行, 按配置的间隔管理所有下载器并统计监控')
+    ARGP.add_argument('--rebuild-monitor', action='store_true', help='清空统计检查点, 重新统计所有日志')
+    ARGP.add_argument('--dry-run', action='store_true', help='试运行, 只录制快照和决策, 不修改下载器')
+    ARGP.add_argument('--replay', action='store_true', help='离线回放 -n 下载器录制的快照, 输出决策、耗时和接口调用次数')
 
     argp = ARGP.parse_args()
     qb_name = argp.qb_name
+    daemon = argp.daemon
+    rebuild = argp.rebuild_monitor
+    dry_run = argp.dry_run
+    replay = argp.replay
 
 
 # 统计监控
 def monitor():
-    Monitor().analysis_torrent()
+    if rebuild:
+        Monitor().rebuild().analysis_torrent()
+    else:
+        Monitor().analysis_torrent()
     
     
 # 管理种子
@@ -36,31 +58,69 @@ def manage_torrents():
         print('None')
         exit(-1)
     downloaders = os.getenv('ALL_DOWNLOADERS').split(',')
-    if qb_name not in downloaders:
-        print('没有找此下载器配置, 请检查配置文件')
-        exit(-1)
-    qb = Qb(qb_name=qb_name)
-    qb.login()
+    qb_names = qb_name.split(',')
+    for name in qb_names:
+        if name not in downloaders:
+            print('没有找此下载器配置, 请检查配置文件')
+            exit(-1)
+    # 继续发送上次未发送的消息
+    load_notify(qb_names=qb_names)
 
-    tries = 1
-    if qb.cookie is None and tries <= 5:
-        tries += 1
-        qb.login()
+    # 多个下载器并发处理
+    if len(qb_names) > 1:
+        if not Daemon(dry_run=dry_run).run_once(qb_names=qb_names):
+            exit(-1)
+        return True
 
-    if qb.cookie is None:
+    qb = Qb(qb_name=qb_name, dry_run=dry_run)
+    if not qb.check_login():
         print('登录失败，请检查用户信息')
         exit(-1)
 
-    # 处理种子
-    qb.get_torrents().handle_torrents()
-    
+    # 处理种子, 获取种子列表失败时不处理上次保存的种子表
+    if not qb.get_torrents().fetched:
+        print('获取种子列表失败')
+        exit(-1)
+    qb.handle_torrents()
+    if dry_run:
+        for row in qb.decisions:
+            print(json.dumps(row, ensure_ascii=False))
+
+
+# 离线回放
+def replay_snapshots():
+    if qb_name is None or qb_name == '':
+        print('回放需要指定下载器名称')
+        exit(-1)
+    for name in qb_name.split(','):
+        report = Replay(qb_name=name).run()
+        for row in report['cycles']:
+            print(f"{row['snapshot']} 种子数: {row['torrents']} 耗时: {row['cycle_time']}s 接口调用: {row['api_calls']} 决策: {len(row['decisions'])}")
+        print(f"{name} 回放 {len(report['cycles'])} 轮, 总耗时: {report['total_cycle_time']}s 接口调用: {report['total_api_calls']} 决策: {report['total_decisions']}")
+
 
 if __name__ == '__main__':
     # 加载env文件
     load_dotenv(verbose=True)
     args()
-    if qb_name is None or qb_name == '':
+    # 启动时解析并校验配置
+    try:
+        get_settings()
+    except ValueError as e:
+        print(e)
+        exit(-1)
+    if replay:
+        replay_snapshots()
+    elif daemon:
+        Daemon(dry_run=dry_run).run()
+    elif qb_name is None or qb_name == '' or rebuild:
         monitor()
     else:
         manage_torrents()
+    # 等待TG消息发送, 未发送的下次启动继续发送
+    flush_notify()
+    # 写入本次修改的文件
+    flush_files()
+    # 写入指标文件
+    export_metrics()
     print('Done')
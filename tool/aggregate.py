@@ -0,0 +1,136 @@
+"""
+删种流量聚合
+"""
+import datetime
+import json
+
+
+# 日期所属的周 (ISO 周)
+def week_of(date=None):
+    year, week, _ = datetime.date.fromisoformat(date).isocalendar()
+    return f'{year}-W{week:02d}'
+
+
+# 日期所属的月
+def month_of(date=None):
+    return date[:7]
+
+
+class Aggregate:
+    # 聚合维度
+    dimensions = ['downloader', 'domain', 'category', 'date']
+    # (下载器, 站点, 分类, 日期) => [下行, 上行, 删种数]
+    rows = {}
+
+    '''
+    实例化
+    :param rows 已保存的聚合数据 [[下载器, 站点, 分类, 日期, 下行, 上行, 删种数], ...]
+    '''
+    def __init__(self, rows=None):
+        self.rows = {}
+        for row in rows if rows is not None else []:
+            self.rows[tuple(row[:4])] = list(row[4:])
+
+    '''
+    累加一条删种数据
+    :param downloader 下载器名称
+    :param domain 站点域名
+    :param category 分类
+    :param date 日期
+    :param rx 下行流量
+    :param tx 上行流量
+    '''
+    def add(self, downloader=None, domain=None, category=None, date=None, rx=0, tx=0):
+        key = (downloader, domain, category, date)
+        row = self.rows.get(key)
+        if row is None:
+            self.rows[key] = [rx, tx, 1]
+        else:
+            row[0] += rx
+            row[1] += tx
+            row[2] += 1
+        return self
+
+    '''
+    合并另一份聚合数据
+    :param aggregate 聚合数据
+    '''
+    def merge(self, aggregate=None):
+        for key, value in aggregate.rows.items():
+            row = self.rows.get(key)
+            if row is None:
+                self.rows[key] = list(value)
+            else:
+                row[0] += value[0]
+                row[1] += value[1]
+                row[2] += value[2]
+        return self
+
+    '''
+    导出保存
+    '''
+    def dump(self):
+        return [list(key) + value for key, value in self.rows.items()]
+
+    '''
+    按维度汇总
+    :param dimension 维度 downloader/domain/category, 为空时只按时间汇总
+    :param period 时间粒度 day/week/month
+    '''
+    def group(self, dimension=None, period='day'):
+        index = self.dimensions.index(dimension) if dimension is not None else None
+        result = {}
+        for key, value in self.rows.items():
+            date = key[3]
+            if period == 'week':
+                date = week_of(date=date)
+            elif period == 'month':
+                date = month_of(date=date)
+            content = result.setdefault(key[index] if index is not None else 'total', {})
+            for name in [date, 'total']:
+                row = content.get(name)
+                if row is None:
+                    content[name] = {'rx': value[0], 'tx': value[1], 'count': value[2]}
+                else:
+                    row['rx'] += value[0]
+                    row['tx'] += value[1]
+                    row['count'] += value[2]
+        if index is None:
+            return result.get('total', {'total': {'rx': 0, 'tx': 0, 'count': 0}})
+        return result
+
+    '''
+    上行流量排名
+    :param dimension 维度
+    :param number 数量
+    :param date 日期, 为空时按累计排名
+    '''
+    def top(self, dimension='domain', number=5, date=None):
+        content = self.group(dimension=dimension)
+        name = date if date is not None else 'total'
+        rows = [(key, value[name]) for key, value in content.items() if name in value]
+        rows.sort(key=lambda x: x[1]['tx'], reverse=True)
+        return rows[:number]
+
+
+# 解析删种事件文件中新增的完整行, 可在子进程中执行
+# tasks [(分类/文件名, 路径, 已解析位置)], 按顺序返回 [(分类/文件名, 聚合数据, 新的解析位置)]
+def parse_events(tasks=None):
+    result = []
+    for key, path, offset in tasks:
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        # 只处理完整的行
+        end = data.rfind(b'\n') + 1
+        aggregate = Aggregate()
+        for line in data[:end].splitlines():
+            if len(line.strip()) == 0:
+                continue
+            event = json.loads(line)
+            # TX为上行流量
+            # RX为下行流量
+            aggregate.add(downloader=event['downloader'], domain=event['domain'], category=event['category'],
+                          date=event['date'], rx=event['downloaded'], tx=event['uploaded'])
+        result.append((key, aggregate.dump(), offset + end))
+    return result
@@ -0,0 +1,83 @@
+"""
+种子文件列表缓存 (/api/v2/torrents/files)
+"""
+import json
+import os
+from collections import OrderedDict
+
+from tool.file import File
+
+
+class ContentCache:
+    qb_name = None
+    # 内存中最多保存的种子数
+    capacity = 1000
+    # 种子HASH => [[序号, 大小, 文件名], ...], 按最近使用排序
+    rows = None
+
+    '''
+    实例化
+    :param qb_name 配置的下载器名称
+    :param capacity 内存中最多保存的种子数
+    :param dirname 磁盘缓存目录
+    '''
+    def __init__(self, qb_name=None, capacity=None, dirname='cache'):
+        self.qb_name = qb_name
+        if capacity is not None:
+            self.capacity = capacity
+        self.rows = OrderedDict()
+        self.file = File(dirname=dirname, category_dir=qb_name)
+
+    '''
+    读取文件列表, 内存 => 磁盘 => 接口, 获取失败时返回 None
+    :param torrent_hash 种子HASH
+    :param fetch 从接口获取文件列表的函数, 获取失败返回 None
+    '''
+    def get(self, torrent_hash=None, fetch=None):
+        rows = self.rows.get(torrent_hash)
+        if rows is not None:
+            self.rows.move_to_end(torrent_hash)
+            return self.expand(rows=rows)
+
+        rows = self.file.get_file(filename=torrent_hash + '.json').response
+        self.file.response = None
+        if rows is None:
+            content = fetch(torrent_hash)
+            if content is None:
+                return None
+            # 只保留选文件需要的字段
+            rows = [[row['index'], row['size'], row['name']] for row in content]
+            self.file.write_file(filename=torrent_hash + '.json', data=json.dumps(rows, ensure_ascii=False, separators=(',', ':')))
+        self.put(torrent_hash=torrent_hash, rows=rows)
+        return self.expand(rows=rows)
+
+    '''
+    放入内存, 超出容量时淘汰最久未使用的
+    :param torrent_hash 种子HASH
+    :param rows 文件列表
+    '''
+    def put(self, torrent_hash=None, rows=None):
+        self.rows[torrent_hash] = rows
+        self.rows.move_to_end(torrent_hash)
+        while len(self.rows) > self.capacity:
+            self.rows.popitem(last=False)
+        return self
+
+    '''
+    展开成接口返回的格式
+    :param rows 文件列表
+    '''
+    def expand(self, rows=None):
+        return [{'index': row[0], 'size': row[1], 'name': row[2]} for row in rows]
+
+    '''
+    清理已不存在的种子
+    :param hashes 当前所有种子HASH
+    '''
+    def prune(self, hashes=None):
+        for torrent_hash in [row for row in self.rows if row not in hashes]:
+            del self.rows[torrent_hash]
+        for filename in os.listdir(self.file.dirname):
+            if filename.endswith('.json') and filename[:-5] not in hashes:
+                self.file.remove_file(filename=filename)
+        return self
@@ -0,0 +1,153 @@
+"""
+常驻调度
+"""
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from tool.file import flush_files
+from tool.metrics import get_metrics, export_metrics
+from tool.monitor import Monitor
+from tool.notify import load_notify
+from tool.qb import Qb
+from tool.settings import get_settings
+
+
+class Daemon:
+    # 所有下载器
+    downloaders = []
+    # 下载器实例 名称 => Qb
+    qbs = {}
+    # 下载器执行间隔 (秒)
+    intervals = {}
+    # 下一次执行时间
+    next_run = {}
+    # 监控执行间隔 (秒)
+    monitor_interval = 0
+    # 监控下一次执行时间
+    monitor_next_run = 0
+    # 并发执行的线程数
+    workers = 0
+    # 执行中的任务 名称 => Future
+    futures = {}
+    # 试运行
+    dry_run = False
+
+    '''
+    实例化
+    :param dry_run 试运行, 只录制快照不修改下载器
+    '''
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self.downloaders = [name for name in os.getenv('ALL_DOWNLOADERS').split(',') if name != '']
+        self.qbs = {}
+        self.intervals = {}
+        self.next_run = {}
+        settings = get_settings()
+        for name in self.downloaders:
+            self.intervals[name] = settings.downloader(name=name).interval
+            self.next_run[name] = 0
+        self.monitor_interval = settings.monitor_interval
+        self.monitor_next_run = 0
+        # 每个下载器一个线程, 再加一个给监控, 单个下载器超时不影响其他下载器
+        self.workers = settings.daemon_workers or len(self.downloaders) + 1
+        self.futures = {}
+
+    '''
+    常驻运行
+    '''
+    def run(self):
+        # 指标 HTTP 服务
+        port = get_settings().metrics_port
+        if port > 0:
+            get_metrics().serve(port=port)
+        # 继续发送上次未发送的消息
+        load_notify(qb_names=self.downloaders)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                now = time.time()
+                for name in self.downloaders:
+                    # 上一轮还未结束的下载器不重复提交
+                    if self.running(name=name) or now < self.next_run[name]:
+                        continue
+                    self.futures[name] = executor.submit(self.run_downloader, qb_name=name)
+                    self.next_run[name] = now + self.intervals[name]
+
+                if self.monitor_interval > 0 and not self.running(name='monitor') and now >= self.monitor_next_run:
+                    self.futures['monitor'] = executor.submit(self.run_monitor)
+                    self.monitor_next_run = now + self.monitor_interval
+
+                wait_time = min(self.next_run.values(), default=now + 1) - time.time()
+                if self.monitor_interval > 0:
+                    wait_time = min(wait_time, self.monitor_next_run - time.time())
+                # 至少每秒检查一次执行中的任务
+                time.sleep(min(max(wait_time, 0.1), 1))
+
+    '''
+    并发执行一次指定的下载器, 等待全部完成
+    :param qb_names 下载器名称列表
+    '''
+    def run_once(self, qb_names=None):
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(qb_names))) as executor:
+            futures = [executor.submit(self.run_downloader, qb_name=name) for name in qb_names]
+            wait(futures)
+        return all([future.result() for future in futures])
+
+    '''
+    任务是否执行中
+    :param name 下载器名称 / monitor
+    '''
+    def running(self, name=None):
+        future = self.futures.get(name)
+        return future is not None and not future.done()
+
+    '''
+    执行一次下载器管理
+    :param qb_name 下载器名称
+    '''
+    def run_downloader(self, qb_name=None):
+        try:
+            qb = self.qbs.get(qb_name)
+            if qb is None:
+                qb = Qb(qb_name=qb_name, dry_run=self.dry_run)
+                self.qbs[qb_name] = qb
+
+            if not qb.check_login():
+                print(f'{qb_name} 登录失败，请检查用户信息')
+                return False
+
+            qb.get_torrents()
+            # 登录失效, 下个周期重新登录
+            if qb.response['code'] == 403:
+                qb.cookie = None
+                return False
+            # 获取失败时种子表是旧的, 不处理
+            if not qb.fetched:
+                print(f'{qb_name} 获取种子列表失败')
+                return False
+            qb.handle_torrents()
+            return True
+        except Exception:
+            print(f'{qb_name} 处理失败')
+            traceback.print_exc()
+            return False
+        finally:
+            flush_files()
+            export_metrics()
+
+    '''
+    执行一次统计监控
+    '''
+    def run_monitor(self):
+        try:
+            with get_metrics().timer(qb_name='monitor', phase='analysis_torrent'):
+                Monitor().analysis_torrent()
+            return True
+        except Exception:
+            print('统计监控失败')
+            traceback.print_exc()
+            return False
+        finally:
+            flush_files()
+            export_metrics()
@@ -0,0 +1,88 @@
+"""
+低收益种子淘汰
+"""
+import heapq
+
+
+class Evict:
+    # 上传速度超过此值的种子不淘汰 byte 字节
+    max_upspeed = 2 * 1024 * 1024
+    # 候选种子最小堆 (上传速度, 序号, 种子数据)
+    heap = []
+    # 已淘汰/已删除的种子HASH
+    removed = set()
+
+    '''
+    实例化, 每轮只建一次堆
+    :param torrents 所有种子
+    :param exclude_domains 不删种的站点
+    :param exclude_hashes 已计划删除的种子HASH
+    '''
+    def __init__(self, torrents=None, exclude_domains=None, exclude_hashes=None):
+        exclude_domains = set(exclude_domains if exclude_domains is not None else [])
+        self.removed = set(exclude_hashes if exclude_hashes is not None else [])
+        self.heap = []
+        for index, item in enumerate(torrents):
+            if item['state'] == 'pausedDL':
+                continue
+            if item['upspeed'] > self.max_upspeed:
+                continue
+            # 无法删除的种子不能释放空间
+            if item['domain'] in exclude_domains or item['state'] in ['forcedDL', 'forcedUP']:
+                continue
+            self.heap.append((item['upspeed'], index, item))
+        heapq.heapify(self.heap)
+
+    '''
+    当前收益最低的种子
+    :param filter_name 排除的种子名称
+    '''
+    def peek(self, filter_name=None):
+        skipped = []
+        result = {}
+        while len(self.heap) > 0:
+            entry = self.heap[0]
+            if entry[2]['hash'] in self.removed:
+                heapq.heappop(self.heap)
+                continue
+            if filter_name is not None and entry[2]['name'] in filter_name:
+                skipped.append(heapq.heappop(self.heap))
+                continue
+            result = entry[2]
+            break
+        for entry in skipped:
+            heapq.heappush(self.heap, entry)
+        return result
+
+    '''
+    计算释放指定空间需要淘汰的种子, 空间不够时不淘汰
+    :param need_size 需要释放的空间 byte 字节
+    '''
+    def plan(self, need_size=None):
+        victims = []
+        popped = []
+        free_size = 0
+        while free_size < need_size and len(self.heap) > 0:
+            entry = heapq.heappop(self.heap)
+            if entry[2]['hash'] in self.removed:
+                continue
+            popped.append(entry)
+            victims.append(entry[2])
+            free_size += entry[2]['size']
+
+        if free_size < need_size:
+            for entry in popped:
+                heapq.heappush(self.heap, entry)
+            return []
+
+        for item in victims:
+            self.removed.add(item['hash'])
+        return victims
+
+    '''
+    种子已删除/已恢复, 不再作为候选
+    :param torrent_hash 种子HASH
+    '''
+    def discard(self, torrent_hash=None):
+        self.removed.add(torrent_hash)
+        return self
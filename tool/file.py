@@ -1,9 +1,24 @@
 """
-文件类封装
+文件类封装, 写入先保存在内存中, 每轮结束时统一落盘
 """
+import atexit
 import json
 import os
 import re
+import shutil
+import threading
+
+# 待写入的文件 路径 => 内容
+pending = {}
+# 正在落盘的文件, 替换完成前仍从这里读取
+flushing = {}
+# 需要指定权限的文件 路径 => 权限
+modes = {}
+pending_lock = threading.Lock()
+# 同一时间只有一个线程落盘, 避免旧内容覆盖新内容
+flush_lock = threading.Lock()
+# 已创建的目录
+created_dirs = set()
 
 
 # 修复文件名
@@ -11,10 +26,93 @@ def repair_filename(filename=None):
     return filename.replace(' ', '.').replace('\'', '').replace('[', '').replace(']', '').replace('(', '').replace(')', '').replace('&', '-').replace('}}', '}').replace('{{', '{')
 
 
+# 创建目录, 同一目录只检查一次
+def make_dirs(dirname=None):
+    if dirname not in created_dirs:
+        os.makedirs(dirname, exist_ok=True)
+        created_dirs.add(dirname)
+    return dirname
+
+
+# 待写入的文件统一落盘: 先全部写入临时文件, 再依次 fsync、替换, 最后每个目录 fsync 一次
+def flush_files():
+    with flush_lock:
+        with pending_lock:
+            items = list(pending.items())
+            flushing.update(pending)
+            pending.clear()
+        if len(items) == 0:
+            return 0
+
+        dirnames = set()
+        try:
+            temps = []
+            for filename, content in items:
+                make_dirs(dirname=os.path.dirname(filename))
+                temp = f'{filename}.{os.getpid()}.tmp'
+                mode = modes.get(filename)
+                fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode if mode is not None else 0o666)
+                # 临时文件已存在时创建权限不生效
+                if mode is not None:
+                    os.fchmod(fd, mode)
+                with open(fd, 'w', encoding='utf-8') as f:
+                    f.write(content)
+                temps.append((temp, filename))
+
+            for temp, filename in temps:
+                fd = os.open(temp, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+                os.replace(temp, filename)
+                dirnames.add(os.path.dirname(filename))
+        except OSError:
+            # 写入失败的文件下次再落盘, 不覆盖之后写入的内容
+            with pending_lock:
+                for filename, content in items:
+                    pending.setdefault(filename, content)
+            raise
+        finally:
+            with pending_lock:
+                flushing.clear()
+
+        for dirname in dirnames:
+            try:
+                fd = os.open(dirname, os.O_RDONLY)
+            except OSError:
+                continue
+            try:
+                os.fsync(fd)
+            except OSError:
+                pass
+            finally:
+                os.close(fd)
+        return len(items)
+
+
+# 删除目录, 同时丢弃目录下待写入的文件
+def remove_dir(dirname=None):
+    prefix = dirname.rstrip('/') + '/'
+    with pending_lock:
+        for filename in [row for row in pending if row.startswith(prefix)]:
+            del pending[filename]
+    for row in [row for row in created_dirs if row == dirname or row.startswith(prefix)]:
+        created_dirs.discard(row)
+    shutil.rmtree(dirname, ignore_errors=True)
+    return dirname
+
+
+# 进程退出前落盘
+atexit.register(flush_files)
+
+
 class File:
     dirname = None
     response = None
+    # 目录下所有文件
     files = []
+    # 分类 => 分类目录下所有文件
     categories = {}
 
     '''
@@ -30,20 +128,24 @@ class File:
         if category_dir is not None:
             self.dirname += '/' + str(category_dir)
 
-        if not os.path.exists(self.dirname):
-            os.makedirs(self.dirname)
+        self.response = None
+        self.files = []
+        self.categories = {}
+        make_dirs(dirname=self.dirname)
 
     '''
-    读取文件
+    读取文件, 未落盘的文件读取内存中的内容
     :param filename 文件名
     '''
     def get_file(self, filename=None):
         filename = self.dirname + '/' + filename
         # 修复文件名
         filename = repair_filename(filename=filename)
-        if os.path.exists(filename):
-            f = open(filename, 'r', encoding='utf-8')
-            content = f.read()
+        content = pending.get(filename, flushing.get(filename))
+        if content is None and os.path.exists(filename):
+            with open(filename, 'r', encoding='utf-8') as f:
+                content = f.read()
+        if content is not None:
             if str(filename).find('.json') > 1:
                 self.response = json.loads(content)
             else:
@@ -52,24 +154,65 @@ class File:
         return self
 
     '''
-    写入文件
+    文件是否存在
+    :param filename 文件名
+    '''
+    def exists(self, filename=None):
+        filename = repair_filename(filename=self.dirname + '/' + filename)
+        return filename in pending or filename in flushing or os.path.exists(filename)
+
+    '''
+    写入文件, 先保存在内存中, flush_files 时落盘, 同一文件只写入最后一次的内容
     :param filename 文件名
     :param data 写入的文件内容
+    :param mode 文件权限, 为空时按 umask
     '''
-    def write_file(self, filename=None, data=None):
+    def write_file(self, filename=None, data=None, mode=None):
         filename = self.dirname + '/' + filename
         
         # 修复文件名
         filename = repair_filename(filename=filename)
-        
-        with open(filename, 'w', encoding='utf-8') as f:
-            if isinstance(data, dict):
-                json.dump(data, f, indent=4, ensure_ascii=False)
-            else:
-                f.write(data)
+
+        # 写入时序列化, 之后修改 data 不影响写入的内容
+        content = json.dumps(data, indent=4, ensure_ascii=False) if isinstance(data, dict) else data
+        with pending_lock:
+            pending[filename] = content
+            if mode is not None:
+                modes[filename] = mode
 
         return self
+
+    '''
+    删除文件
+    :param filename 文件名
+    '''
+    def remove_file(self, filename=None):
+        filename = repair_filename(filename=self.dirname + '/' + filename)
+        with pending_lock:
+            pending.pop(filename, None)
+        if os.path.exists(filename):
+            os.remove(filename)
+        return self
         
+    '''
+    追加写入文件, O_APPEND 单次写入, 多进程同时追加也不会覆盖
+    :param filename 文件名
+    :param data 追加的内容
+    '''
+    def append_file(self, filename=None, data=None):
+        filename = self.dirname + '/' + filename
+
+        # 修复文件名
+        filename = repair_filename(filename=filename)
+
+        fd = os.open(filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data.encode('utf-8'))
+        finally:
+            os.close(fd)
+
+        return self
+
     '''
     获取所有分类目录下文件
     :param dirname 目录
@@ -0,0 +1,86 @@
+"""
+暂停种子的选种决策记录
+"""
+import hashlib
+import json
+import time
+
+from tool.file import File
+
+
+# 决策输入的指纹
+def fingerprint(values=None):
+    return hashlib.sha1(json.dumps(values, ensure_ascii=False, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class Memo:
+    qb_name = None
+    # 种子HASH => 决策
+    records = {}
+    # 是否有未保存的修改
+    dirty = False
+    # 上次保存时间
+    saved_at = 0
+    # 最短保存间隔 (秒), 单次运行时每次都保存
+    save_interval = 600
+
+    '''
+    实例化
+    :param qb_name 配置的下载器名称
+    :param dirname 保存目录
+    :param save_interval 最短保存间隔 (秒)
+    '''
+    def __init__(self, qb_name=None, dirname='decisions', save_interval=None):
+        self.qb_name = qb_name
+        if save_interval is not None:
+            self.save_interval = save_interval
+        self.file = File(dirname=dirname)
+        data = self.file.get_file(filename=self.qb_name + '.json').response
+        self.records = data.get('records', {}) if data is not None else {}
+        self.dirty = False
+
+    '''
+    读取决策, 输入变化时返回 None
+    :param torrent_hash 种子HASH
+    :param key 决策输入的指纹
+    '''
+    def get(self, torrent_hash=None, key=None):
+        record = self.records.get(torrent_hash)
+        if record is None or record['fingerprint'] != key:
+            return None
+        return record
+
+    '''
+    保存决策
+    :param torrent_hash 种子HASH
+    :param key 决策输入的指纹
+    :param record 决策
+    '''
+    def put(self, torrent_hash=None, key=None, record=None):
+        record['fingerprint'] = key
+        self.records[torrent_hash] = record
+        self.dirty = True
+        return record
+
+    '''
+    清理已不存在的种子
+    :param hashes 当前所有种子HASH
+    '''
+    def prune(self, hashes=None):
+        for torrent_hash in [row for row in self.records if row not in hashes]:
+            del self.records[torrent_hash]
+            self.dirty = True
+        return self
+
+    '''
+    写入文件, 没有修改或距上次保存不到最短间隔时不保存
+    :param force 是否忽略保存间隔
+    '''
+    def save(self, force=False):
+        now = time.time()
+        if not self.dirty or (not force and now - self.saved_at < self.save_interval):
+            return self
+        self.file.write_file(filename=self.qb_name + '.json', data=json.dumps({'records': self.records}, ensure_ascii=False, separators=(',', ':')))
+        self.dirty = False
+        self.saved_at = now
+        return self
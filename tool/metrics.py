@@ -0,0 +1,249 @@
+"""
+运行指标, Prometheus 文本格式导出
+"""
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from tool.settings import get_settings
+
+# 写入 textfile 的锁
+textfile_lock = threading.Lock()
+# 耗时直方图的桶 (秒)
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+# 指标名称 => (类型, 说明)
+METRICS = {
+    'qb_http_requests_total': ('counter', 'HTTP requests by endpoint and status code'),
+    'qb_http_request_seconds': ('histogram', 'HTTP request latency by endpoint'),
+    'qb_http_response_bytes_total': ('counter', 'HTTP response bytes transferred by endpoint, compressed as received'),
+    'qb_api_calls_total': ('counter', 'qBittorrent API calls by downloader, api and status code'),
+    'qb_api_call_seconds': ('histogram', 'qBittorrent API call latency including re-login'),
+    'qb_api_relogin_total': ('counter', 'Re-logins after an expired SID'),
+    'qb_phase_seconds': ('histogram', 'Time spent in each phase of a cycle'),
+    'qb_phase_last_seconds': ('gauge', 'Duration of the last run of each phase'),
+    'qb_deleted_torrents_total': ('counter', 'Deleted torrents by rule'),
+    'qb_actions_total': ('counter', 'Batched torrent actions by type'),
+    'qb_torrents': ('gauge', 'Torrents by downloader and kind'),
+    'qb_cycles_total': ('counter', 'Finished torrent management cycles'),
+    'qb_last_cycle_timestamp_seconds': ('gauge', 'Unix time of the last finished cycle'),
+}
+
+metrics = None
+metrics_lock = threading.Lock()
+
+
+# 获取指标
+def get_metrics():
+    global metrics
+    with metrics_lock:
+        if metrics is None:
+            metrics = Metrics()
+        return metrics
+
+
+# 接口地址转换成标签, 去掉 TG TOKEN 等变量
+def endpoint_label(path=None):
+    return re.sub(r'^/bot[^/]+/', '/bot/', path)
+
+
+# 删种规则转换成标签, 去掉数值避免标签过多
+def rule_label(rule=None):
+    return re.sub(r'\d+(\.\d+)?', 'N', str(rule))
+
+
+# 标签值转义
+def escape(value=None):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class Timer:
+    '''
+    实例化
+    :param metrics 指标
+    :param labels 标签
+    '''
+    def __init__(self, metrics=None, labels=None):
+        self.metrics = metrics
+        self.labels = labels
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        seconds = time.perf_counter() - self.start
+        self.metrics.observe(name='qb_phase_seconds', labels=self.labels, value=seconds)
+        self.metrics.set(name='qb_phase_last_seconds', labels=self.labels, value=seconds)
+
+
+class Metrics:
+    # 计数器/仪表 (名称, 标签) => 值
+    values = {}
+    # 直方图 (名称, 标签) => [各个桶的数量, 总和, 总数]
+    histograms = {}
+    # HTTP 服务
+    server = None
+
+    '''
+    实例化
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+        self.histograms = {}
+        self.server = None
+
+    '''
+    标签排序后作为键
+    :param labels 标签
+    '''
+    def key(self, labels=None):
+        return tuple(sorted((labels if labels is not None else {}).items()))
+
+    '''
+    计数器增加
+    :param name 指标名称
+    :param labels 标签
+    :param value 增加的值
+    '''
+    def inc(self, name=None, labels=None, value=1):
+        key = (name, self.key(labels=labels))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+        return self
+
+    '''
+    仪表设置
+    :param name 指标名称
+    :param labels 标签
+    :param value 值
+    '''
+    def set(self, name=None, labels=None, value=0):
+        with self.lock:
+            self.values[(name, self.key(labels=labels))] = value
+        return self
+
+    '''
+    直方图记录一次
+    :param name 指标名称
+    :param labels 标签
+    :param value 值
+    '''
+    def observe(self, name=None, labels=None, value=0):
+        key = (name, self.key(labels=labels))
+        with self.lock:
+            row = self.histograms.get(key)
+            if row is None:
+                row = [[0] * len(BUCKETS), 0.0, 0]
+                self.histograms[key] = row
+            for index, bucket in enumerate(BUCKETS):
+                if value <= bucket:
+                    row[0][index] += 1
+            row[1] += value
+            row[2] += 1
+        return self
+
+    '''
+    阶段计时
+    :param qb_name 下载器名称
+    :param phase 阶段
+    '''
+    def timer(self, qb_name=None, phase=None):
+        return Timer(metrics=self, labels={'qb': qb_name, 'phase': phase})
+
+    '''
+    Prometheus 文本格式
+    '''
+    def render(self):
+        rows = {}
+        with self.lock:
+            for (name, labels), value in self.values.items():
+                rows.setdefault(name, []).append(f'{name}{self.format_labels(labels=labels)} {value}')
+            for (name, labels), (buckets, total, count) in self.histograms.items():
+                lines = rows.setdefault(name, [])
+                for index, bucket in enumerate(BUCKETS):
+                    lines.append(f'{name}_bucket{self.format_labels(labels=labels, le=bucket)} {buckets[index]}')
+                lines.append(f'{name}_bucket{self.format_labels(labels=labels, le="+Inf")} {count}')
+                lines.append(f'{name}_sum{self.format_labels(labels=labels)} {total}')
+                lines.append(f'{name}_count{self.format_labels(labels=labels)} {count}')
+
+        text = ''
+        for name in sorted(rows.keys()):
+            metric_type, help_text = METRICS.get(name, ('untyped', name))
+            text += f'# HELP {name} {help_text}\n# TYPE {name} {metric_type}\n'
+            text += '\n'.join(rows[name]) + '\n'
+        return text
+
+    '''
+    标签文本
+    :param labels 标签
+    :param le 直方图的桶
+    '''
+    def format_labels(self, labels=None, le=None):
+        labels = list(labels)
+        if le is not None:
+            labels.append(('le', le))
+        if len(labels) == 0:
+            return ''
+        return '{' + ','.join([f'{key}="{escape(value)}"' for key, value in labels]) + '}'
+
+    '''
+    写入 textfile collector 文件, 先写临时文件再替换
+    :param filename 文件路径
+    '''
+    def write_textfile(self, filename=None):
+        dirname = os.path.dirname(filename)
+        if dirname != '':
+            os.makedirs(dirname, exist_ok=True)
+        # 常驻模式下多个线程同时导出, 临时文件按线程区分, 依次替换
+        temp = filename + '.' + str(os.getpid()) + '.' + str(threading.get_ident()) + '.tmp'
+        with textfile_lock:
+            with open(temp, 'w', encoding='utf-8') as f:
+                f.write(self.render())
+            os.replace(temp, filename)
+        return self
+
+    '''
+    启动 HTTP 服务, 访问 /metrics
+    :param port 端口
+    :param host 监听地址
+    '''
+    def serve(self, port=None, host='127.0.0.1'):
+        if self.server is not None:
+            return self
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                data = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+
+# 导出指标, 配置了 METRICS_TEXTFILE 时写入文件
+def export_metrics():
+    filename = get_settings().metrics_textfile
+    if filename is None:
+        return False
+    if not os.path.isabs(filename):
+        filename = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + '/' + filename
+    get_metrics().write_textfile(filename=filename)
+    return True
@@ -1,12 +1,42 @@
 """
 监控
 """
+import json
+import multiprocessing
 import os
 import time
 import re
+from concurrent.futures import ProcessPoolExecutor
+
+from tool.aggregate import Aggregate, parse_events, week_of, month_of
 from tool.tool import Tool
 from tool.file import File
 from tool.request import Request
+from tool.settings import get_settings
+
+
+# 待解析的内容达到这个大小 (byte 字节) 才用进程池, 启动子进程比解析小文件更慢
+PARALLEL_MIN_BYTES = 64 * 1024 * 1024
+
+
+# 字节转换成展示文本
+def byte_text(number=None):
+    return Tool(number=number).change_byte(decimal=2).text
+
+
+# 扫描删种事件文件, 按分类、文件名排序, 返回 [(分类/文件名, 路径, 文件信息)]
+def scan_events(dirname=None):
+    rows = []
+    if not os.path.isdir(dirname):
+        return rows
+    with os.scandir(dirname) as entries:
+        categories = sorted([entry for entry in entries if entry.is_dir()], key=lambda x: x.name)
+    for category in categories:
+        with os.scandir(category.path) as entries:
+            files = sorted([entry for entry in entries if entry.name.endswith('.jsonl') and entry.is_file()], key=lambda x: x.name)
+        for entry in files:
+            rows.append((category.name + '/' + entry.name, entry.path, entry.stat()))
+    return rows
 
 
 class Monitor:
@@ -18,8 +48,10 @@ class Monitor:
     files = {}
     # 所有下载器
     downloaders = []
-    # 文件内容
-    file_content = []
+    # 聚合数据
+    aggregate = None
+    # 排名数量
+    top_number = 5
     
     # 下载器的数据
     downloaders_content = {}
@@ -27,6 +59,13 @@ class Monitor:
     domain_content = {}
     # 所有数据
     total_content = {}
+    # 本周/本月数据
+    week_content = {}
+    month_content = {}
+    # 日志检查点 分类/文件名 => 大小、修改时间、已解析位置
+    checkpoint = {}
+    # 统计数据版本
+    version = 1
     
     '''
     实例化
@@ -37,16 +76,28 @@ class Monitor:
         self.tg_token = os.getenv('MONITOR_TG_TOKEN')
         self.tg_chat_id = os.getenv('MONITOR_TG_CHAT_ID')
         self.downloaders = os.getenv('ALL_DOWNLOADERS').split(',')
+        # 常驻模式下会多次实例化, 不能共用类属性
+        self.top_number = get_settings().monitor_top_n
+        self.files = {}
+        self.aggregate = Aggregate()
+        self.downloaders_content = {}
+        self.domain_content = {}
+        self.total_content = {}
+        self.week_content = {}
+        self.month_content = {}
+        self.checkpoint = {}
 
     '''
     分析种子
     '''
     def analysis_torrent(self):
-        categories = File(dirname='logs').get_category_dir_all_files().categories
-        self.analysis_file(categories=categories)
-        self.analysis_total()
-        self.analysis_downloader()
-        self.analysis_domain()
+        self.load_state()
+        # 旧的文本日志只需导入一次
+        self.import_legacy_logs()
+        files = scan_events(dirname=File(dirname='events').dirname)
+        self.analysis_file(files=files, workers=get_settings().monitor_workers)
+        self.analysis()
+        self.save_state()
         self.send_analysis_message()
         
     '''
@@ -61,10 +112,10 @@ class Monitor:
             today_rx = 0
             today_tx = 0
             if date in self.domain_content[content]:
-                today_rx = self.domain_content[content][date]['rx_text']
-                today_tx = self.domain_content[content][date]['tx_text']
-            total_rx = self.domain_content[content]['total']['rx_text']
-            total_tx = self.domain_content[content]['total']['tx_text']
+                today_rx = byte_text(self.domain_content[content][date]['rx'])
+                today_tx = byte_text(self.domain_content[content][date]['tx'])
+            total_rx = byte_text(self.domain_content[content]['total']['rx'])
+            total_tx = byte_text(self.domain_content[content]['total']['tx'])
             text += f"站点域名: {content}\r\n" \
                     f"今日流量: {today_tx}↑/ {today_rx}↓\r\n" \
                     f"累计流量: {total_tx}↑/ {total_rx}↓\r\n" \
@@ -76,10 +127,10 @@ class Monitor:
             today_rx = 0
             today_tx = 0
             if date in self.downloaders_content[content]:
-                today_rx = self.downloaders_content[content][date]['rx_text']
-                today_tx = self.downloaders_content[content][date]['tx_text']
-            total_rx = self.downloaders_content[content]['total']['rx_text']
-            total_tx = self.downloaders_content[content]['total']['tx_text']
+                today_rx = byte_text(self.downloaders_content[content][date]['rx'])
+                today_tx = byte_text(self.downloaders_content[content][date]['tx'])
+            total_rx = byte_text(self.downloaders_content[content]['total']['rx'])
+            total_tx = byte_text(self.downloaders_content[content]['total']['tx'])
             text += f"下载器名: {content}\r\n" \
                     f"今日流量: {today_tx}↑/ {today_rx}↓\r\n" \
                     f"累计流量: {total_tx}↑/ {total_rx}↓\r\n" \
@@ -90,15 +141,27 @@ class Monitor:
         today_rx = 0
         today_tx = 0
         if date in self.total_content:
-            today_rx = self.total_content[date]['rx_text']
-            today_tx = self.total_content[date]['tx_text']
-        total_rx = self.total_content['total']['rx_text']
-        total_tx = self.total_content['total']['tx_text']
+            today_rx = byte_text(self.total_content[date]['rx'])
+            today_tx = byte_text(self.total_content[date]['tx'])
+        total_rx = byte_text(self.total_content['total']['rx'])
+        total_tx = byte_text(self.total_content['total']['tx'])
+        week = week_of(date=date)
+        month = month_of(date=date)
+        week_row = self.week_content.get(week, {'rx': 0, 'tx': 0})
+        month_row = self.month_content.get(month, {'rx': 0, 'tx': 0})
         text += f"今日流量: {today_tx}↑/ {today_rx}↓\r\n" \
+                f"本周流量: {byte_text(week_row['tx'])}↑/ {byte_text(week_row['rx'])}↓\r\n" \
+                f"本月流量: {byte_text(month_row['tx'])}↑/ {byte_text(month_row['rx'])}↓\r\n" \
                 f"累计流量: {total_tx}↑/ {total_rx}↓\r\n" \
                 f"--------------------------------------\r\n"
+
+        # 站点上行排名
+        text += f'**************站点排名 TOP{self.top_number}**************\r\n'
+        for index, (domain, row) in enumerate(self.aggregate.top(dimension='domain', number=self.top_number)):
+            text += f"{index + 1}. {domain}: {byte_text(row['tx'])}↑/ {byte_text(row['rx'])}↓ 删种{row['count']}个\r\n"
+        text += "--------------------------------------\r\n"
                     
-        api_url = 'https://api.telegram.org/bot' + self.tg_token + '/sendMessage'
+        api_url = get_settings().tg_api_url + '/bot' + self.tg_token + '/sendMessage'
         data = {
             'chat_id': self.tg_chat_id,
             'text': text,
@@ -106,141 +169,142 @@ class Monitor:
         Request(url=api_url, data=data).curl()
                     
     '''
-    分析下载器
-    '''
-    def analysis_downloader(self): 
-        content = {}
-        for item in self.file_content:
-            
-            if item['name'] not in content.keys():
-                content[item['name']] = {}
-            
-            if item['date'] not in content[item['name']].keys():
-                content[item['name']][item['date']] = {}
-            
-            if len(content[item['name']][item['date']]) == 0:
-                content[item['name']][item['date']] = {
-                    'rx': item['rx'],
-                    'tx': item['tx']
-                }
-            else:
-                content[item['name']][item['date']]['rx'] += item['rx']
-                content[item['name']][item['date']]['tx'] += item['tx']
-
-        for downloader in content:
-            total = {'rx': 0, 'tx': 0}
-            for date in content[downloader].keys():
-                rx = content[downloader][date]['rx']
-                content[downloader][date]['rx_text'] = Tool(number=rx).change_byte(decimal=2).text
-                tx = content[downloader][date]['tx']
-                content[downloader][date]['tx_text'] = Tool(number=tx).change_byte(decimal=2).text
-
-                total['rx'] += rx
-                total['tx'] += tx
-            
-            total['rx_text'] = Tool(number=total['rx']).change_byte(decimal=2).text
-            total['tx_text'] = Tool(number=total['tx']).change_byte(decimal=2).text
-            content[downloader]['total'] = total
-        
-        self.downloaders_content = content
+    从聚合数据生成各维度统计
+    '''
+    def analysis(self):
+        self.downloaders_content = self.aggregate.group(dimension='downloader')
+        self.domain_content = self.aggregate.group(dimension='domain')
+        self.total_content = self.aggregate.group()
+        self.week_content = self.aggregate.group(period='week')
+        self.month_content = self.aggregate.group(period='month')
         return self
         
     '''
-    分析站点数据
-    '''
-    def analysis_domain(self): 
-        content = {}
-        for item in self.file_content:
-            
-            if item['domain'] not in content.keys():
-                content[item['domain']] = {}
-            
-            if item['date'] not in content[item['domain']].keys():
-                content[item['domain']][item['date']] = {}
-            
-            if len(content[item['domain']][item['date']]) == 0:
-                content[item['domain']][item['date']] = {
-                    'rx': item['rx'],
-                    'tx': item['tx']
-                }
-            else:
-                content[item['domain']][item['date']]['rx'] += item['rx']
-                content[item['domain']][item['date']]['tx'] += item['tx']
-
-        for downloader in content:
-            total = {'rx': 0, 'tx': 0}
-            for date in content[downloader].keys():
-                rx = content[downloader][date]['rx']
-                content[downloader][date]['rx_text'] = Tool(number=rx).change_byte(decimal=2).text
-                tx = content[downloader][date]['tx']
-                content[downloader][date]['tx_text'] = Tool(number=tx).change_byte(decimal=2).text
-
-                total['rx'] += rx
-                total['tx'] += tx
-            
-            total['rx_text'] = Tool(number=total['rx']).change_byte(decimal=2).text
-            total['tx_text'] = Tool(number=total['tx']).change_byte(decimal=2).text
-            content[downloader]['total'] = total
-        
-        self.domain_content = content
-        return self    
-    
+    分析删种事件, 只解析上次检查点之后新增的内容
+    :param files 删种事件文件 scan_events
+    :param workers 解析的进程数
     '''
-    分析总数据
-    '''
-    def analysis_total(self): 
-        content = {}
-        for item in self.file_content:
-            if item['date'] not in content.keys():
-                content[item['date']] = {}
-            
-            if len(content[item['date']]) == 0:
-                content[item['date']] = {
-                    'rx': item['rx'],
-                    'tx': item['tx']
-                }
-            else:
-                content[item['date']]['rx'] += item['rx']
-                content[item['date']]['tx'] += item['tx']
-
-        total = {'rx': 0, 'tx': 0}
-        for date in content.keys():
-            rx = content[date]['rx']
-            content[date]['rx_text'] = Tool(number=rx).change_byte(decimal=2).text
-            tx = content[date]['tx']
-            content[date]['tx_text'] = Tool(number=tx).change_byte(decimal=2).text
-
-            total['rx'] += rx
-            total['tx'] += tx
-        
-        total['rx_text'] = Tool(number=total['rx']).change_byte(decimal=2).text
-        total['tx_text'] = Tool(number=total['tx']).change_byte(decimal=2).text
-        content['total'] = total
-        self.total_content = content
+    def analysis_file(self, files=None, workers=1):
+        tasks = []
+        stats = {}
+        for key, path, stat in files:
+            checkpoint = self.checkpoint.get(key, {'size': 0, 'mtime': 0, 'offset': 0})
+            if stat.st_size == checkpoint['size'] and stat.st_mtime == checkpoint['mtime']:
+                continue
+            if stat.st_size < checkpoint['offset']:
+                print(f'{key} 文件被截断, 请使用 --rebuild-monitor 重新统计')
+                self.checkpoint[key] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'offset': stat.st_size}
+                continue
+            tasks.append((key, path, checkpoint['offset']))
+            stats[key] = stat
+
+        # 按文件顺序合并, 与单进程解析的结果一致
+        for key, rows, offset in self.parse_events(tasks=tasks, workers=workers):
+            self.aggregate.merge(aggregate=Aggregate(rows=rows))
+            self.checkpoint[key] = {'size': stats[key].st_size, 'mtime': stats[key].st_mtime, 'offset': offset}
         return self
-        
+
     '''
-    分析文件
+    解析删种事件, 文件较多且待解析内容较大时按字节数分成连续的几段, 用进程池并行解析
+    :param tasks [(分类/文件名, 路径, 已解析位置)]
+    :param workers 进程数
     '''
-    def analysis_file(self, categories=None):
+    def parse_events(self, tasks=None, workers=1):
+        if workers <= 1 or len(tasks) < workers * 2:
+            return parse_events(tasks=tasks)
+        sizes = [max(0, os.path.getsize(path) - offset) for _, path, offset in tasks]
+        if sum(sizes) < PARALLEL_MIN_BYTES:
+            return parse_events(tasks=tasks)
+
+        limit = max(1, sum(sizes) // (workers * 4))
+        chunks = [[]]
+        total = 0
+        for task, size in zip(tasks, sizes):
+            if total >= limit:
+                chunks.append([])
+                total = 0
+            chunks[-1].append(task)
+            total += size
+
+        result = []
+        # 常驻模式下有其他线程, 子进程使用 spawn 启动
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            for rows in executor.map(parse_events, chunks):
+                result += rows
+        return result
+
+    '''
+    导入旧的文本日志到删种事件, 导入后重命名为 .imported
+    '''
+    def import_legacy_logs(self):
+        dirname = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + '/logs'
+        if not os.path.isdir(dirname):
+            return 0
+        # 只列出还没导入的 .log 文件, 已导入的 .imported 不再读取
+        categories = {}
+        with os.scandir(dirname) as entries:
+            for entry in entries:
+                if not entry.is_dir():
+                    continue
+                with os.scandir(entry.path) as files:
+                    names = [row.name for row in files if row.name.endswith('.log') and row.is_file()]
+                if len(names) > 0:
+                    categories[entry.name] = names
+        number = 0
         for category, files in categories.items():
             for filename in files:
-                file_content = File(dirname='logs', category_dir=category).get_file(filename=filename) 
-                file_content = file_content.response.replace(' ', '').replace('↑', '').replace('↓', '')
-                content = re.findall(r'下载器名:(.*)?[\s\S]*?流量统计:(.*)?[\s\S]*?站点域名:(.*)?', file_content)
+                file = File(dirname='logs', category_dir=category)
+                file_content = file.get_file(filename=filename).response
+                file_content = file_content.replace(' ', '').replace('↑', '').replace('↓', '')
+                content = re.findall(r'下载器名:(.*)?[\s\S]*?所属分类:(.*)?[\s\S]*?流量统计:(.*)?[\s\S]*?站点域名:(.*)?', file_content)
+                date = filename.replace('.log', '')
+                lines = ''
                 for row in content:
-                    downloader = row[0]
-                    rxtx = row[1].split('/')
-                    domain = row[2]
-                    # TX为上行流量
-                    # RX为下行流量
-                    self.file_content.append({
-                        'name': downloader,
-                        'category': category,
-                        'domain': domain,
-                        'date': filename.replace('.log', ''),
-                        'tx': Tool().text_to_byte(text=rxtx[0]).value,
-                        'rx': Tool().text_to_byte(text=rxtx[1]).value
-                    })
+                    rxtx = row[2].split('/')
+                    event = {
+                        'date': date,
+                        'downloader': row[0],
+                        'category': row[1],
+                        'domain': row[3],
+                        'uploaded': Tool().text_to_byte(text=rxtx[0]).value,
+                        'downloaded': Tool().text_to_byte(text=rxtx[1]).value,
+                        'legacy': True,
+                    }
+                    lines += json.dumps(event, ensure_ascii=False) + '\n'
+                if lines != '':
+                    File(dirname='events', category_dir=category).append_file(filename=date + '.jsonl', data=lines)
+                os.rename(file.dirname + '/' + filename, file.dirname + '/' + filename + '.imported')
+                number += len(content)
+        return number
+
+    '''
+    读取检查点及统计数据
+    '''
+    def load_state(self):
+        file = File(dirname='monitor')
+        state = file.get_file(filename='state.json').response
+        version = state.get('version') if state is not None else None
+        if version == self.version:
+            self.checkpoint = state['checkpoint']
+            self.aggregate = Aggregate(rows=state['rows'])
+        else:
+            # 统计来源已改为删种事件, 旧版本的统计数据重新计算
+            self.rebuild()
+        return self
+
+    '''
+    保存检查点及统计数据, 写在同一个文件中, 中途退出时不会重复统计
+    '''
+    def save_state(self):
+        file = File(dirname='monitor')
+        file.write_file(filename='state.json', data={'version': self.version, 'checkpoint': self.checkpoint, 'rows': self.aggregate.dump()})
+        return self
+
+    '''
+    清空检查点, 重新统计所有日志
+    '''
+    def rebuild(self):
+        self.checkpoint = {}
+        self.aggregate = Aggregate()
+        self.save_state()
         return self
-    
\ No newline at end of file
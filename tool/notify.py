@@ -0,0 +1,264 @@
+"""
+TG通知队列
+"""
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+
+from tool.file import File
+from tool.request import Request
+from tool.settings import get_settings
+
+notify = None
+notify_lock = threading.Lock()
+
+
+# 获取通知队列
+def get_notify():
+    global notify
+    with notify_lock:
+        if notify is None:
+            notify = Notify()
+        return notify
+
+
+# 启动时读取下载器未发送的消息, 有消息时启动后台发送
+def load_notify(qb_names=None):
+    file = File(dirname='notify')
+    if not any([file.exists(filename=name + '.json') for name in qb_names]):
+        return 0
+    return get_notify().load(qb_names=qb_names)
+
+
+# 立即发送并等待通知发送完成, 超时未发送的已保存, 下次启动继续发送
+def flush_notify(timeout=10):
+    if notify is None:
+        return True
+    return notify.flush(timeout=timeout)
+
+
+# 保存未发送的消息
+def save_notify():
+    if notify is None:
+        return False
+    with notify.condition:
+        notify.save()
+    return True
+
+
+class Notify:
+    # 合并等待时间 (秒)
+    coalesce_seconds = 5
+    # 单条消息最大长度
+    max_length = 4096
+    # 同一频道两次发送间隔 (秒)
+    send_interval = 1
+    # 单次最大重试次数
+    max_tries = 5
+    # 发送失败后再次尝试的间隔 (秒)
+    retry_interval = 60
+    # 待发送消息
+    messages = []
+    # 已读取队列文件的下载器
+    loaded = set()
+    # 有未保存消息的下载器
+    dirty = set()
+    # 是否立即发送, 不再等待合并
+    urgent = False
+
+    '''
+    实例化
+    '''
+    def __init__(self):
+        self.file = File(dirname='notify')
+        self.condition = threading.Condition()
+        self.messages = []
+        self.loaded = set()
+        self.dirty = set()
+        self.thread = threading.Thread(target=self.worker, daemon=True)
+        self.thread.start()
+
+    '''
+    读取下载器未发送的消息, 每个下载器一个队列文件, 多个进程同时运行时互不覆盖
+    :param qb_names 配置的下载器名称列表
+    '''
+    def load(self, qb_names=None):
+        with self.condition:
+            for qb_name in qb_names:
+                if qb_name in self.loaded:
+                    continue
+                self.loaded.add(qb_name)
+                data = File(dirname='notify').get_file(filename=qb_name + '.json').response
+                if data is not None:
+                    self.messages += data.get('messages', [])
+            self.condition.notify_all()
+            return len(self.messages)
+
+    '''
+    加入队列
+    :param qb_name 配置的下载器名称
+    :param text 消息内容
+    '''
+    def push(self, qb_name=None, text=None):
+        with self.condition:
+            # 先读取上次未发送的消息, 保存时不覆盖
+            self.load(qb_names=[qb_name])
+            self.messages.append({
+                'id': uuid.uuid4().hex,
+                'qb_name': qb_name,
+                'text': text,
+                'time': int(time.time()),
+            })
+            # 每轮结束或发送前统一保存
+            self.dirty.add(qb_name)
+            self.condition.notify_all()
+        return True
+
+    '''
+    保存未发送的消息, 调用时需持有 condition
+    '''
+    def save(self):
+        for qb_name in self.dirty:
+            messages = [row for row in self.messages if row['qb_name'] == qb_name]
+            self.file.write_file(filename=qb_name + '.json', data={'messages': messages})
+        self.dirty = set()
+        return self
+
+    '''
+    等待队列发送完成
+    :param timeout 最长等待时间 (秒)
+    '''
+    def flush(self, timeout=10):
+        end_time = time.time() + timeout
+        with self.condition:
+            self.urgent = True
+            self.condition.notify_all()
+            while len(self.messages) > 0:
+                wait = end_time - time.time()
+                if wait <= 0:
+                    # 未发送的下次启动继续发送
+                    self.save()
+                    return False
+                self.condition.wait(timeout=wait)
+            self.save()
+        return True
+
+    '''
+    后台发送
+    '''
+    def worker(self):
+        while True:
+            with self.condition:
+                while len(self.messages) == 0:
+                    self.condition.wait()
+                # 等待同一轮的删种消息, 合并成一条, 退出前不再等待
+                end_time = time.time() + self.coalesce_seconds
+                while not self.urgent and time.time() < end_time:
+                    self.condition.wait(timeout=end_time - time.time())
+            try:
+                delivered = self.send_digest()
+            except Exception:
+                traceback.print_exc()
+                delivered = False
+            if not delivered:
+                time.sleep(self.retry_interval)
+
+    '''
+    按下载器合并发送
+    '''
+    def send_digest(self):
+        with self.condition:
+            self.save()
+            # 复制后再分组, 分组时会截断消息
+            messages = [dict(row) for row in self.messages]
+
+        groups = {}
+        for message in messages:
+            groups.setdefault(message['qb_name'], []).append(message)
+
+        delivered = True
+        for qb_name, rows in groups.items():
+            # 没有配置TG的下载器直接丢弃, 不用等待发送间隔
+            if (os.getenv(qb_name + '_TG_TOKEN') or '') == '':
+                self.remove(rows=rows)
+                continue
+            for chunk in self.chunks(rows=rows):
+                if not self.send(qb_name=qb_name, text='==========================\r\n'.join([row['text'] for row in chunk])):
+                    delivered = False
+                    break
+                self.remove(rows=chunk)
+                time.sleep(self.send_interval)
+        return delivered
+
+    '''
+    移出已发送的消息
+    :param rows 消息列表
+    '''
+    def remove(self, rows=None):
+        ids = set([row['id'] for row in rows])
+        with self.condition:
+            self.messages = [row for row in self.messages if row['id'] not in ids]
+            self.dirty.update([row['qb_name'] for row in rows])
+            self.save()
+            self.condition.notify_all()
+        return self
+
+    '''
+    按最大长度分组
+    :param rows 消息列表
+    '''
+    def chunks(self, rows=None):
+        chunk = []
+        length = 0
+        for row in rows:
+            row['text'] = row['text'][:self.max_length]
+            size = len(row['text']) + 28
+            if len(chunk) > 0 and length + size > self.max_length:
+                yield chunk
+                chunk = []
+                length = 0
+            chunk.append(row)
+            length += size
+        if len(chunk) > 0:
+            yield chunk
+
+    '''
+    发送到TG, 限流时按 retry_after 重试, 其他错误指数退避
+    :param qb_name 配置的下载器名称
+    :param text 消息内容
+    '''
+    def send(self, qb_name=None, text=None):
+        token = os.getenv(qb_name + '_TG_TOKEN')
+        chat_id = os.getenv(qb_name + '_TG_CHAT_ID')
+        if token is None or token == '':
+            return True
+
+        api_url = get_settings().tg_api_url + '/bot' + token + '/sendMessage'
+        data = {
+            'chat_id': chat_id,
+            'text': text,
+        }
+        for tries in range(self.max_tries):
+            wait = 2 ** tries
+            try:
+                response = Request(url=api_url, data=data).curl().response
+            except Exception:
+                time.sleep(wait)
+                continue
+
+            if response['code'] == 200:
+                return True
+            if response['code'] == 429:
+                try:
+                    wait = json.loads(response['content'])['parameters']['retry_after']
+                except (ValueError, KeyError, TypeError):
+                    pass
+            elif 400 <= response['code'] < 500:
+                # 消息本身有误, 重试也无法发送
+                print(f'{qb_name} TG消息发送失败: {response["content"]}')
+                return True
+            time.sleep(wait)
+        return False
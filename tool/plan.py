@@ -0,0 +1,71 @@
+"""
+种子批量操作计划
+"""
+
+
+class Plan:
+    # 批量执行顺序
+    actions_order = ['delete', 'pause', 'resume', 'reannounce']
+    # 种子HASH => 操作
+    actions = {}
+    # 计划删除后释放的空间 byte 字节
+    free_space = 0
+
+    '''
+    实例化
+    '''
+    def __init__(self):
+        self.actions = {}
+        self.free_space = 0
+
+    '''
+    加入计划
+    :param action 操作 delete/pause/resume/reannounce
+    :param item 种子数据
+    :param rule 删种规则
+    :param delete_files 是否连带文件一起删除
+    '''
+    def add(self, action=None, item=None, rule=None, delete_files=True):
+        torrent_hash = item['hash']
+        current = self.actions.get(torrent_hash)
+        # 已计划删除的种子不再做其他操作
+        if current is not None and current['action'] == 'delete':
+            return False
+
+        if action == 'delete':
+            self.free_space += item['size']
+        self.actions[torrent_hash] = {
+            'action': action,
+            'item': item,
+            'rule': rule,
+            'delete_files': delete_files if action == 'delete' else None,
+        }
+        return True
+
+    '''
+    种子是否已加入计划
+    :param torrent_hash 种子HASH
+    :param action 操作, 为空时不限操作
+    '''
+    def has(self, torrent_hash=None, action=None):
+        current = self.actions.get(torrent_hash)
+        if current is None:
+            return False
+        return action is None or current['action'] == action
+
+    '''
+    按操作及是否删除文件分组
+    '''
+    def groups(self):
+        groups = {}
+        for row in self.actions.values():
+            groups.setdefault((row['action'], row['delete_files']), []).append(row)
+        return sorted(groups.items(), key=lambda x: self.actions_order.index(x[0][0]))
+
+    '''
+    清空计划
+    '''
+    def clear(self):
+        self.actions = {}
+        self.free_space = 0
+        return self
@@ -2,13 +2,26 @@
 QB下载器API
 """
 import json
-import os
 import re
 import time
+from functools import lru_cache
 from urllib.parse import urlparse, unquote
 
-from tool.file import File
+from tool.content import ContentCache
+from tool.evict import Evict
+from tool.file import File, flush_files
+from tool.memo import Memo, fingerprint
+from tool.metrics import get_metrics, rule_label
+from tool.notify import save_notify
+from tool.plan import Plan
+from tool.replay import Snapshot, WRITE_APIS
 from tool.request import Request
+from tool.rules import Table, evaluate
+from tool.selector import filter_files, select_files, select_single_file
+from tool.settings import get_settings
+from tool.stream import JsonStream
+from tool.stats import SpeedStats
+from tool.sync import FETCH_FILTERS, Sync
 from tool.tool import Tool
 
 # 解析站点域名
@@ -28,7 +41,8 @@ def time_format(unix_time=None, format_type="%Y-%m-%d %H:%M:%S"):
     return time.strftime(format_type, time.localtime(unix_time))
 
 
-# 截取制作组
+# 截取制作组, 同名种子只解析一次
+@lru_cache(maxsize=65536)
 def get_torrent_group(name=None):
     group = name.rsplit('-', 1)
     if len(group) == 2 and len(group[1].rsplit('@', 1)) == 2:
@@ -46,40 +60,22 @@ def get_torrent_group(name=None):
 def check_group(name=None, category=None):
     group = get_torrent_group(name=name)
     if category is not None:
-        groups = os.getenv(str(category).upper() + '_GROUP')
+        groups = get_settings().category(name=category).group
     else:
-        groups = os.getenv('ALL_GROUP')
-    
-    if groups is not None:
-        groups = groups.split(',')
+        groups = get_settings().all_group
     return group in groups
 
 
 # 是否属于HR种子
 def check_hr_group(domain=None, name=None, category=None):
-    hr_domains = os.getenv('HR_DOMAIN').split(',')
-    hr_groups = os.getenv(category + '_HR_GROUP')
-    if domain in hr_domains and hr_groups is not None:
-        hr_groups = hr_groups.split(',')
+    settings = get_settings()
+    hr_groups = settings.category(name=category).hr_group
+    if domain in settings.hr_domain and hr_groups is not None:
         group = get_torrent_group(name=name)
         return group in hr_groups
     return False
     
 
-# 最近几次的上传速度
-def get_recently_avg_upspeed(item=None, number=10):
-    file = File(dirname='torrents', category_dir=item['domain'])
-    data = file.get_file(filename=item['name'] + '.json').response
-    if data is not None and len(data['info']) > number:
-        info = data['info'][len(data['info']) - number:]
-        total_update_speed = 0
-        for row in info:
-            total_update_speed += float(row['upspeed'])
-        avg_update_speed = int(total_update_speed / number)
-        return avg_update_speed
-    return False    
-
-
 class Qb:
     qb_name = None
     url = None
@@ -123,31 +119,61 @@ class Qb:
     total_download_choose_file_size = 0
     # 排除不删种的站点
     torrent_filter_delete_domain = 0
+    # 低收益种子淘汰堆
+    evict = None
+    # 试运行, 只记录决策不修改下载器
+    dry_run = False
+    # 本轮录制的快照
+    snapshot = None
+    # 离线回放
+    replay = None
+    # 回放时的当前时间
+    now = None
+    # 本轮的决策
+    decisions = []
+    # 本轮是否获取到种子列表, 失败时不处理种子
+    fetched = False
 
     '''
     实例化
     :param qb_name 配置的下载器名称
+    :param dry_run 试运行
     '''
 
-    def __init__(self, qb_name=None):
+    def __init__(self, qb_name=None, dry_run=False):
         self.qb_name = qb_name
-        self.url = os.getenv(qb_name + '_URL')
-        self.username = os.getenv(qb_name + '_USERNAME')
-        self.password = os.getenv(qb_name + '_PASSWORD')
-        self.disk_space = int(os.getenv(qb_name + '_DISK_SPACE'))
-        self.less_disk_space = int(os.getenv(qb_name + '_LESS_DOSK_SPACE'))
-        self.limit_active_torrent_num = int(os.getenv(qb_name + '_LIMIT_ACTIVE_TORRENT_NUM'))
+        self.dry_run = dry_run
+        self.decisions = []
+        self.settings = get_settings()
+        downloader = self.settings.downloader(name=qb_name)
+        self.url = downloader.url
+        self.username = downloader.username
+        self.password = downloader.password
+        self.disk_space = downloader.disk_space
+        self.less_disk_space = downloader.less_disk_space
+        self.limit_active_torrent_num = downloader.limit_active_torrent_num
+        self.connect_timeout = downloader.connect_timeout
+        self.timeout = downloader.timeout
+        self.fetch_mode = downloader.fetch_mode
+        self.full_fetch_interval = downloader.full_fetch_interval
+        self.response = {}
         self.active_torrent_state = ['uploading', 'downloading', 'stalledDL', 'stalledUP', 'forcedDL', 'forcedUP']
-        self.limit_torrent_download_size = int(os.getenv(self.qb_name + '_LIMIT_TORRENT_DOWNLOAD_SIZE'))
-        
-        self.torrent_split_filter_max_size = float(os.getenv('TORRENT_SPLIT_FILTER_MAX_SIZE'))
-        self.torrent_split_filter_min_size = float(os.getenv('TORRENT_SPLIT_FILTER_MIN_SIZE'))
-        self.torrent_split_domain = os.getenv('TORRENT_SPLIT_DOMAIN').split(',')
-        self.black_torrent_domain = os.getenv('BLACK_TORRENT_DOMAIN').split(',')
-        self.hr_limit_size = int(os.getenv('HR_LIMIT_MIN_CHOOSE_SIZE'))
-        self.hr_domain = os.getenv('HR_DOMAIN').split(',')
-        self.all_group = os.getenv('ALL_GROUP').split(',')
-        self.torrent_filter_delete_domain = os.getenv('TORRENT_FILTER_DELETE_DOMAIN').split(',')
+        self.limit_torrent_download_size = downloader.limit_torrent_download_size
+        
+        self.torrent_split_filter_max_size = self.settings.torrent_split_filter_max_size
+        self.torrent_split_filter_min_size = self.settings.torrent_split_filter_min_size
+        self.torrent_split_domain = self.settings.torrent_split_domain
+        self.black_torrent_domain = self.settings.black_torrent_domain
+        self.hr_limit_size = self.settings.hr_limit_size
+        self.hr_domain = self.settings.hr_domain
+        self.all_group = self.settings.all_group
+        self.torrent_filter_delete_domain = self.settings.torrent_filter_delete_domain
+        self.sync = Sync(qb_name=self.qb_name, active_torrent_state=self.active_torrent_state,
+                         save_interval=downloader.save_interval)
+        self.plan = Plan()
+        self.content_cache = ContentCache(qb_name=self.qb_name, capacity=self.settings.content_cache_size)
+        self.memo = Memo(qb_name=self.qb_name, save_interval=downloader.save_interval)
+        self.stats = SpeedStats(qb_name=self.qb_name, save_interval=downloader.save_interval)
         
     '''
     登录
@@ -159,44 +185,138 @@ class Qb:
             'username': self.username,
             'password': self.password
         }
+        self.cookie = None
         self.curl_request(api_name=api_name, data=data)
         if self.response['code'] == 200:
-            r = re.findall(r'set-cookie: (.+?);', self.response['header'], re.S | re.M)
-            self.cookie = r[0] if len(r) > 0 else None
+            self.cookie = self.response.get('cookie')
+        self.save_cookie()
+        return self
+
+    '''
+    读取缓存的SID
+    '''
+
+    def load_cookie(self):
+        data = File(dirname='cookies').get_file(filename=self.qb_name + '.json').response
+        if data is not None and data.get('url') == self.url:
+            self.cookie = data.get('cookie')
+        return self
+
+    '''
+    缓存SID
+    '''
+
+    def save_cookie(self):
+        data = {
+            'url': self.url,
+            'cookie': self.cookie
+        }
+        # SID 明文保存, 只允许当前用户读写
+        File(dirname='cookies').write_file(filename=self.qb_name + '.json', data=data, mode=0o600)
         return self
 
+    '''
+    检查登录状态, 优先使用缓存的SID, 未登录时重试登录
+    :param tries 最大尝试次数
+    '''
+
+    def check_login(self, tries=5):
+        with get_metrics().timer(qb_name=self.qb_name, phase='login'):
+            if self.cookie is None:
+                self.load_cookie()
+            while self.cookie is None and tries > 0:
+                tries -= 1
+                self.login()
+        return self.cookie is not None
+
     '''
     获取种子列表
     '''
     
     def get_torrents(self):
-        api_name = '/api/v2/torrents/info'
-        self.curl_request(api_name=api_name)
-        if self.response['code'] == 200:
-            self.torrents = json.loads(self.response['content'])
-            # 总数
-            self.total_torrent_num = len(self.torrents)
-            for row in self.torrents:
-                # 解析域名
-                category = str(row['category']).upper()
-                row['domain'] = os.getenv(category + '_DOMAIN')
-                
-                # 所有活跃种子
-                if row['state'] in self.active_torrent_state:
-                    self.total_download_choose_file_size += row['size']
+        self.fetched = False
+        with get_metrics().timer(qb_name=self.qb_name, phase='get_torrents'):
+            if self.fetch_mode == 'filter':
+                success = self.fetch_torrents()
+            else:
+                api_name = '/api/v2/sync/maindata'
+                data = {
+                    'rid': self.sync.rid
+                }
+                # 增量同步的种子表总是最新的
+                self.sync.fresh = None
+                # 边接收边更新种子表
+                self.sync.begin()
+                try:
+                    self.curl_request(api_name=api_name, data=data, stream=JsonStream(callback=self.sync.feed, expand=['torrents']))
+                except Exception:
+                    # 种子表可能只更新了一部分, 下轮全量同步
+                    self.sync.commit(success=False)
+                    raise
+                success = self.response['code'] == 200
+                self.sync.commit(success=success)
+            self.fetched = success
+            if success:
+                self.sync.save()
+                # 已删除种子的文件列表、速度统计不再保留
+                self.content_cache.prune(hashes=self.sync.torrents)
+                self.stats.prune(hashes=self.sync.torrents)
+
+        self.torrents = list(self.sync.torrents.values())
+        self.total_torrent_num = self.sync.total_torrent_num
+        self.active_torrent_num = self.sync.active_torrent_num
+        self.pause_torrent_num = self.sync.pause_torrent_num
+        self.total_download_choose_file_size = self.sync.total_download_choose_file_size
+        metrics = get_metrics()
+        metrics.set(name='qb_torrents', labels={'qb': self.qb_name, 'kind': 'total'}, value=self.total_torrent_num)
+        metrics.set(name='qb_torrents', labels={'qb': self.qb_name, 'kind': 'active'}, value=self.active_torrent_num)
+        metrics.set(name='qb_torrents', labels={'qb': self.qb_name, 'kind': 'paused'}, value=self.pause_torrent_num)
 
-                # 下载/上传活跃种子数
-                if row['state'] in ['uploading', 'downloading']:
-                    self.active_torrent_num += 1
-                    
-                # 暂停种子数
-                if row['state'] in ['pausedDL']:
-                    self.pause_torrent_num += 1
-        
         # 计算剩余空间
         self.free_space = Tool(number=self.disk_space).to_byte(unit='GB').value - self.total_download_choose_file_size
+
+        # 试运行录制本轮快照
+        if self.dry_run and self.replay is None:
+            self.snapshot = Snapshot(qb_name=self.qb_name, torrents=self.torrents)
         return self
     
+    '''
+    按状态获取种子, 下载中/错误的种子每轮获取, 做种等其他种子隔几轮随全量获取
+    '''
+
+    def fetch_torrents(self):
+        api_name = '/api/v2/torrents/info'
+        self.sync.cycle += 1
+        self.sync.dirty = True
+        if len(self.sync.torrents) == 0 or self.sync.cycle >= self.full_fetch_interval:
+            self.sync.cycle = 0
+            filters = [None]
+            self.sync.fresh = None
+        else:
+            filters = list(FETCH_FILTERS.keys())
+            # 做种等其他种子本轮没有更新, 不参与采样和删种规则
+            self.sync.fresh = set()
+
+        missing = []
+        for name in filters:
+            data = {'filter': name} if name is not None else None
+            self.sync.begin()
+            self.curl_request(api_name=api_name, data=data, stream=JsonStream(callback=self.sync.feed_row))
+            if self.response['code'] != 200:
+                return False
+            missing += self.sync.merge(states=FETCH_FILTERS.get(name))
+
+        # 状态已变化的种子单独获取, 没返回的已删除
+        if len(missing) > 0:
+            self.sync.begin()
+            self.curl_request(api_name=api_name, data={'hashes': '|'.join(missing)}, stream=JsonStream(callback=self.sync.feed_row))
+            if self.response['code'] != 200:
+                return False
+            for torrent_hash in missing:
+                if torrent_hash not in self.sync.seen:
+                    self.sync.remove(torrent_hash=torrent_hash)
+        return True
+
     '''
     获取种子列表
     '''
@@ -225,27 +345,11 @@ class Qb:
         if item['state'] in ['forcedDL', 'forcedUP']:
             return True;
         
-        # 发送TG消息
-        Tool(qb_name=self.qb_name).send_message(item=item, rule=rule)
-        
-        api_name = '/api/v2/torrents/delete' 
-        data = {
-            'hashes': item['hash'],
-            'deleteFiles': True if delete_files is None else False
-        }
-        self.curl_request(api_name=api_name, data=data)
-        if self.response['code'] == 200:
-            self.free_space += item['size']
-            self.total_torrent_num -= 1
-            # 暂停的种子
-            if item['state'] == 'pausedDL':
-                self.pause_torrent_num -= 1
-            # 活跃的种子        
-            elif item['state'] in ['uploading', 'downloading']:
-                self.active_torrent_num -= 1
-                
-            return True
-        return False
+        if not self.plan.add(action='delete', item=item, rule=rule, delete_files=True if delete_files is None else False):
+            return False
+        if self.evict is not None:
+            self.evict.discard(torrent_hash=item['hash'])
+        return True
         
     '''
     强制汇报
@@ -253,31 +357,22 @@ class Qb:
     '''
     
     def reannounce(self, item=None):
-        api_name = '/api/v2/torrents/reannounce'
-        data = {
-            'hashes': item['hash'],
-        }
-        self.curl_request(api_name=api_name, data=data)
-        if self.response['code'] == 200:
-            return True
-        return False    
+        return self.plan.add(action='reannounce', item=item)
 
     '''
     继续种子
     :param item 种子数据
+    :param download_size 继续后将占用的空间
     '''
 
-    def resume(self, item=None):
-        api_name = '/api/v2/torrents/resume'
-        data = {
-            'hashes': item['hash'],
-        }
-        self.curl_request(api_name=api_name, data=data)
-        if self.response['code'] == 200:
-            self.pause_torrent_num -= 1
-            self.active_torrent_num += 1
-            return True
-        return False
+    def resume(self, item=None, download_size=0):
+        if not self.plan.add(action='resume', item=item):
+            return False
+        # 本轮后续种子入列时计入这部分空间
+        self.plan.free_space -= download_size
+        if self.evict is not None:
+            self.evict.discard(torrent_hash=item['hash'])
+        return True
 
     '''
     暂停种子
@@ -285,15 +380,52 @@ class Qb:
     '''
 
     def pause(self, item=None):
-        api_name = '/api/v2/torrents/pause'
-        data = {
-            'hashes': item['hash'],
-        }
-        self.curl_request(api_name=api_name, data=data)
-        if self.response['code'] == 200:
-            self.pause_torrent_num += 1
-            return True
-        return False
+        return self.plan.add(action='pause', item=item)
+
+    '''
+    批量执行计划中的操作, 每种操作一次请求
+    '''
+
+    def flush_actions(self):
+        try:
+            for (action, delete_files), rows in self.plan.groups():
+                api_name = '/api/v2/torrents/' + action
+                data = {
+                    'hashes': '|'.join([row['item']['hash'] for row in rows]),
+                }
+                if action == 'delete':
+                    data['deleteFiles'] = delete_files
+                self.curl_request(api_name=api_name, data=data)
+                if self.response['code'] != 200:
+                    continue
+
+                metrics = get_metrics()
+                metrics.inc(name='qb_actions_total', labels={'qb': self.qb_name, 'action': action}, value=len(rows))
+                for row in rows:
+                    item = row['item']
+                    self.decisions.append({'action': action, 'hash': item['hash'], 'name': item['name'], 'rule': row['rule']})
+                    if action == 'delete':
+                        metrics.inc(name='qb_deleted_torrents_total', labels={'qb': self.qb_name, 'rule': rule_label(rule=row['rule'])})
+                        self.free_space += item['size']
+                        self.total_torrent_num -= 1
+                        # 暂停的种子
+                        if item['state'] == 'pausedDL':
+                            self.pause_torrent_num -= 1
+                        # 活跃的种子
+                        elif item['state'] in ['uploading', 'downloading']:
+                            self.active_torrent_num -= 1
+                        # 发送TG消息, 试运行不发送
+                        if not self.dry_run:
+                            Tool(qb_name=self.qb_name).send_message(item=item, rule=row['rule'])
+                    elif action == 'resume':
+                        self.pause_torrent_num -= 1
+                        self.active_torrent_num += 1
+                    elif action == 'pause':
+                        self.pause_torrent_num += 1
+        finally:
+            # 请求异常时也清空, 下一轮不重复执行
+            self.plan.clear()
+        return self
 
     '''
     种子通用属性
@@ -315,16 +447,61 @@ class Qb:
     '''
 
     def handle_torrents(self):
-        for row in self.torrents:
-            # 暂停的种子
-            if row['state'] == 'pausedDL':
-                self.handle_pause_torrents(item=row)
-            # 种子错误            
-            elif row['state'] == 'error': 
-                self.handle_error_torrents(item=row)
-            # 活跃的种子        
-            elif row['state'] in self.active_torrent_state:
-                self.handle_active_torrent(item=row)
+        metrics = get_metrics()
+        with metrics.timer(qb_name=self.qb_name, phase='handle_torrents'):
+            self.evict = None
+            self.decisions = []
+            # 上一轮执行失败时留下的操作不再执行
+            self.plan.clear()
+            pause_torrents = []
+            error_torrents = []
+            active_torrents = []
+            for row in self.torrents:
+                # 暂停的种子
+                if row['state'] == 'pausedDL':
+                    pause_torrents.append(row)
+                # 种子错误
+                elif row['state'] == 'error':
+                    error_torrents.append(row)
+                # 活跃的种子, 只处理本轮获取到最新数据的种子
+                elif row['state'] in self.active_torrent_state and self.sync.is_fresh(torrent_hash=row['hash']):
+                    active_torrents.append(row)
+
+            with metrics.timer(qb_name=self.qb_name, phase='handle_error_torrents'):
+                for row in error_torrents:
+                    self.handle_error_torrents(item=row)
+
+            # 活跃种子先批量计算, 删除释放的空间留给暂停的种子
+            with metrics.timer(qb_name=self.qb_name, phase='handle_active_torrents'):
+                self.handle_active_torrents(items=active_torrents)
+
+            with metrics.timer(qb_name=self.qb_name, phase='handle_pause_torrents'):
+                # 只保留仍在暂停的种子的决策
+                self.memo.prune(hashes=set([row['hash'] for row in pause_torrents]))
+                for row in pause_torrents:
+                    # 本轮已计划删除的种子
+                    if self.plan.has(torrent_hash=row['hash'], action='delete'):
+                        continue
+                    self.handle_pause_torrents(item=row)
+
+            with metrics.timer(qb_name=self.qb_name, phase='flush_actions'):
+                self.flush_actions()
+
+            # 试运行没有真正设置文件优先级, 不保存决策
+            if not self.dry_run:
+                self.memo.save()
+            self.stats.save()
+
+            if self.snapshot is not None:
+                self.snapshot.save()
+                self.snapshot = None
+
+            # 本轮修改的文件统一落盘
+            with metrics.timer(qb_name=self.qb_name, phase='flush_files'):
+                save_notify()
+                flush_files()
+        metrics.inc(name='qb_cycles_total', labels={'qb': self.qb_name})
+        metrics.set(name='qb_last_cycle_timestamp_seconds', labels={'qb': self.qb_name}, value=int(time.time()))
         return self
     
     '''
@@ -339,180 +516,162 @@ class Qb:
     '''
     def handle_pause_torrents(self, item=None):
         category = str(item['category']).upper()
+        category_settings = self.settings.category(name=category)
+        is_official_group = check_group(name=item['name'], category=category)
         # 属于站点官组种子
-        if check_group(name=item['name'], category=category):
-            if int(time.time()) - item['added_on'] > 30 * 60:
+        if is_official_group:
+            if self.current_time() - item['added_on'] > 30 * 60:
                 self.delete(item=item, rule='官方种子暂停已超过30分钟')
                 return True 
         else:
-            if int(time.time()) - item['added_on'] > 10 * 60:
+            if self.current_time() - item['added_on'] > 10 * 60:
                 self.delete(item=item, rule='非官方种子暂停已超过10分钟')
                 return True
+
+        # 种子和配置没有变化时直接使用上次的选种结果
+        key = self.pause_fingerprint(item=item, category_settings=category_settings)
+        record = self.memo.get(torrent_hash=item['hash'], key=key)
+        if record is None:
+            record = self.choose_pause_torrent(item=item, category=category, category_settings=category_settings)
+            # 获取文件列表失败, 下一轮重新选种
+            if record is None:
+                return False
+            self.memo.put(torrent_hash=item['hash'], key=key, record=record)
+        elif self.snapshot is not None and item['domain'] in self.torrent_split_domain:
+            # 回放时没有上次的选种结果, 试运行也要把文件列表录制到快照
+            self.torrent_content(torrent_hash=item['hash'])
+
+        if record['delete'] is not None:
+            self.delete(item=item, rule=record['delete'])
+            return True
+
+        # 不下载的文件只设置一次优先级
+        if not record['prio_applied']:
+            record['prio_applied'] = self.change_files_content_download(torrent_hash=item['hash'], index=record['no_download_index'], priority=0)
+            self.memo.dirty = True
+
+        download_size = record['download_size']
+        limit_torrent_download_size = Tool(number=self.limit_torrent_download_size).to_byte(unit='GB').value
+        if category_settings.limit_min_choose_size is not None:
+            limit_torrent_download_size = category_settings.limit_min_choose_byte
+
+        # 属于站点官组种子
+        if is_official_group and limit_torrent_download_size >= download_size: 
+            # 一次算出最少需要淘汰的低收益种子
+            need_size = self.need_free_space(download_size=download_size)
+            if need_size > 0:
+                for lower_income_torrent in self.get_evict().plan(need_size=need_size):
+                    self.delete(item=lower_income_torrent, rule='官组种子进来了, 删除低收益种子')
                 
+        # 剩余空间是否允许
+        if self.check_free_space_enough(download_size=download_size):
+            self.resume(item=item, download_size=download_size)
+        return True      
+
+    '''
+    暂停种子选种决策的输入, 任一项变化时重新选种
+    :param item 种子数据
+    :param category_settings 分类配置
+    '''
+    def pause_fingerprint(self, item=None, category_settings=None):
+        return fingerprint(values=[
+            item['name'], item['category'], item['domain'], item['total_size'],
+            self.limit_torrent_download_size, self.settings.hr_domain, self.settings.hr_limit_byte,
+            self.settings.torrent_split_domain, self.settings.torrent_split_filter_min_byte,
+            self.settings.torrent_split_filter_max_byte, self.settings.split_select_budget,
+            category_settings.hr_group, category_settings.limit_min_choose_byte, category_settings.split_single_file,
+            category_settings.limit_min_download_byte, category_settings.limit_max_download_byte,
+            category_settings.limit_target_download_byte,
+        ])
+
+    '''
+    暂停种子选种, 返回删种规则或选择的文件, 获取文件列表失败时返回 None
+    :param item 种子数据
+    :param category 分类
+    :param category_settings 分类配置
+    '''
+    def choose_pause_torrent(self, item=None, category=None, category_settings=None):
+        record = {'delete': None, 'download_size': item['total_size'], 'no_download_index': '', 'prio_applied': True}
+
         # HR种子
         hr_torrent = check_hr_group(domain=item['domain'], name=item['name'], category=category)
-        if hr_torrent and item['total_size'] < Tool(number=self.hr_limit_size).to_byte(unit='GB').value:
-            self.delete(item=item, rule=f'属于HR种子, 但文件小于{self.hr_limit_size}GB')
-            return True
-            
-        # 获取种子文件内容
-        content = self.torrent_content(torrent_hash=item['hash'])
-        limit_torrent_download_size = Tool(number=self.limit_torrent_download_size).to_byte(unit='GB').value
-        download_size = item['total_size']
-        
+        if hr_torrent and item['total_size'] < self.settings.hr_limit_byte:
+            record['delete'] = f'属于HR种子, 但文件小于{self.hr_limit_size}GB'
+            return record
+
         # 如果设置了分类种子大小
-        limit_category_torrent_download_size = os.getenv(category + '_LIMIT_MIN_CHOOSE_SIZE')
-        if limit_category_torrent_download_size is not None:
-            limit_torrent_download_size = Tool(number=int(limit_category_torrent_download_size)).to_byte(unit='GB').value
-            if limit_torrent_download_size > item['total_size']:
-                self.delete(item=item, rule=f'站点已设置最小入种体积{limit_category_torrent_download_size}GB')   
-                return True
+        if category_settings.limit_min_choose_size is not None:
+            if category_settings.limit_min_choose_byte > item['total_size']:
+                record['delete'] = f'站点已设置最小入种体积{category_settings.limit_min_choose_size}GB'
+                return record
                 
         # 属于拆包站点
         if item['domain'] in self.torrent_split_domain:
+            # 获取种子文件内容, 获取失败时本轮不选种
+            content = self.torrent_content(torrent_hash=item['hash'])
+            if content is None:
+                return None
             # 文件不可拆分
             if len(content) > 1:
                 # 拆分方式
-                split_type = os.getenv(category + '_SPLIT_SINGLE_FILE')
-                if split_type is not None:
+                if category_settings.split_single_file:
                     file_content = self.get_sign_download_content_index(item=item, content=content)
                 else:
                     file_content = self.get_download_content_index(item=item, content=content)
                 if len(file_content['file_index']) > 0:
-                    download_size = file_content['file_size']
+                    record['download_size'] = file_content['file_size']
                     no_download_index = []
                     for row in content:
                         index = str(row['index'])
                         if index not in file_content['file_index']:
                             no_download_index.append(index)
-                    no_download_index = "|".join(no_download_index)
-                    self.change_files_content_download(torrent_hash=item['hash'], index=no_download_index, priority=0)
+                    record['no_download_index'] = "|".join(no_download_index)
+                    record['prio_applied'] = record['no_download_index'] == ''
                     
         # 最后文件体积是否符合下载
-        category_max_download_size = os.getenv(category + '_LIMIT_MAX_DOWNLOAD_SIZE')
-        if category_max_download_size is not None:
-            category_max_download_size = Tool(number=int(category_max_download_size)).to_byte(unit='GB').value
-            if download_size > category_max_download_size:
-                self.delete(item=item, rule='选择下载文件的体积不符合规则')
-                return True
-                
-        #category_min_download_size = os.getenv(category + '_LIMIT_MIN_DOWNLOAD_SIZE')
-        #if category_min_download_size is not None:
-        #    category_min_download_size = Tool(number=int(category_min_download_size)).to_byte(unit='GB').value
-        #    if download_size < category_min_download_size:
-        #        self.delete(item=item, rule='选择下载文件的体积不符合规则')
-        #        return True
-                        
-        # 属于站点官组种子
-        if check_group(name=item['name'], category=category) and limit_torrent_download_size >= download_size: 
-            filter_torrent_name = []
-            while not self.check_free_space_enough(download_size=download_size):
-                lower_income_torrent = self.get_lower_income_torrent(filter_name=filter_torrent_name)
-                filter_torrent_name.append(lower_income_torrent['name'])
-                self.delete(item=lower_income_torrent, rule='官组种子进来了, 删除低收益种子')
-                
-        # 剩余空间是否允许
-        if self.check_free_space_enough(download_size=download_size):
-            self.resume(item=item)
-        return True      
+        if category_settings.limit_max_download_byte is not None:
+            if record['download_size'] > category_settings.limit_max_download_byte:
+                record['delete'] = '选择下载文件的体积不符合规则'
+        return record
     
     '''
     处理活跃的种子
     '''
     
     def handle_active_torrent(self, item=None):
-        # 记录日志
-        self.log_content(item=item)
-        
-        category = str(item['category']).upper()
-        
-        # 最近几次平均速度
-        avg_up_speed = get_recently_avg_upspeed(item=item, number=5)
-        
-        # 查询进度
-        torrent_progress = round(item['downloaded'] / item['total_size'], 2)
-        
-        # 是否属于官组
-        is_official_group = check_group(name=item['name'], category=category)
-        
-        # 是否属于热门官组
-        is_host_group = check_group(name=item['name'])
-        
-        # 是否属于HR官组
-        is_hr_group = check_hr_group(domain=item['domain'], name=item['name'], category=category)
-        
-        # 拆包后下载体积不对
-        if item['domain'] in self.torrent_split_domain:
-            # 分类限制文件最大体积
-            category_limit_max_size = os.getenv(category + '_LIMIT_MAX_DOWNLOAD_SIZE')
-            if category_limit_max_size is not None:
-                category_limit_max_size = Tool(number=int(category_limit_max_size)).to_byte(unit='GB').value
-                if item['size'] > category_limit_max_size:
-                    self.delete(item=item, rule='错误的下载体积')
-                    return True
-        
-        # 黑种站点跳车    
-        if item['domain'] in self.black_torrent_domain:
-            # 3倍分享率跳车
-            if item['uploaded'] / item['total_size'] > 3:
-                self.delete(item=item, rule='3倍分享率跳车')
-                return True
-            # 无效做种
-            if item['completion_on'] > 0 and item['state'] in ['uploading', 'stalledUP']:
-                # 超过一个小时的时候，并且上传小于32kb的种子
-                if type(avg_up_speed) == int and avg_up_speed <= 32 * 1024 and item['upspeed'] <= 32 * 1024 and int(time.time()) - item['completion_on'] >= 60 * 60:
-                    self.delete(item=item, rule='做种60分钟上传速度小于64KB')
-                    return True
-            return True    
-            
-        # HR种子跳车
-        if is_hr_group:
-            hr_download_size = item['total_size'] * float(int(os.getenv(category + '_HR_PROGRESS')) / 100)
-            if hr_download_size - item['downloaded'] <= 5 * 1024 *1024 * 1024:
-                self.delete(item=item, rule='HR种子跳车')
-                return True
-        
-        # 等待发车            
-        if item['state'] == 'stalledDL' and item['progress'] <= 0.05:
-            # 非官组 10分钟不发车
-            if not is_official_group and int(time.time()) - item['added_on'] > 10 * 60:
-                self.delete(item=item, rule='非官组, 10分钟不发车')
-                return True    
-            elif int(time.time()) - item['added_on'] > 1 * 60 * 60:   
-                self.delete(item=item, rule='官组, 60分钟不发车')
-                return True 
-        else:
-            # 最近10次平均速度小于1MB
-            if type(avg_up_speed) == int and avg_up_speed < 512 * 1024 and item['upspeed'] < 512 * 1024:
-                # 种子处于活动状态、活动种子数且小于限制活动种子数 
-                # if item['state'] in ['uploading', 'downloading'] and self.pause_torrent_num == 0 and self.active_torrent_num < self.limit_active_torrent_num:
-                    # return True
-                self.delete(item=item, rule='最近10次平均速度小于1MB')
-                return True
-                
-            if item['state'] == 'downloading' :
-                # 种子添加小于3分钟, 判断连接数、下载人数
-                if int(time.time()) - item['added_on'] < 3 * 60:
-                    if not is_host_group:
-                        # 下载人数
-                        num_incomplete = int(os.getenv(category + '_INCOMPLETE'))
-                        if item['num_incomplete'] < num_incomplete:
-                            self.delete(item=item, rule=f'真实进度{round(torrent_progress * 100, 2)}%, 设置下载人数数{num_incomplete}, 当前种子下载人数{item["num_incomplete"]}')
-                            return True
-                            
-                        # 连接数
-                        num_leechs = int(os.getenv(category + '_LEECHS'))
-                        if item['num_leechs'] < num_leechs:
-                            self.delete(item=item, rule=f'真实进度{round(torrent_progress * 100, 2)}%, 设置连接数{num_leechs}, 当前种子连接数{item["num_leechs"]}')
-                            return True 
-                # 种子添加超过3分钟
-                else:
-                    item['upspeed'] = 1024 if item['upspeed'] == 0 else  item['upspeed']
-                    ratio = round(item['dlspeed'] / item['upspeed'], 2)
-                    # 不是官组、属于黑车
-                    if not is_official_group and item['dlspeed'] > 10 * 1024 * 1024 and item['upspeed'] < 512 * 1024 and ratio > 1.5:
-                        self.delete(item=item, rule=f'不是官组, 且属于黑车')
-                        return True 
+        return self.handle_active_torrents(items=[item])
+
+    '''
+    批量处理活跃的种子, 按列一次计算所有规则
+    :param items 活跃的种子
+    '''
+
+    def handle_active_torrents(self, items=None):
+        table = Table()
+        now = self.current_time()
+        for item in items:
+            # 记录日志
+            self.log_content(item=item)
+
+            category = str(item['category']).upper()
+            flags = {
+                'is_split_domain': item['domain'] in self.torrent_split_domain,
+                'is_black_domain': item['domain'] in self.black_torrent_domain,
+                # 是否属于官组
+                'is_official_group': check_group(name=item['name'], category=category),
+                # 是否属于热门官组
+                'is_host_group': check_group(name=item['name']),
+                # 是否属于HR官组
+                'is_hr_group': check_hr_group(domain=item['domain'], name=item['name'], category=category),
+            }
+            # 上传速度统计
+            stats = self.stats.update(item=item, sample_time=now)
+            table.add(item=item, stats=stats, flags=flags, category_settings=self.settings.category(name=category))
+
+        decisions, rule_ids, rules = evaluate(table=table, now=now)
+        for index, item in enumerate(table.items):
+            if decisions[index]:
+                self.delete(item=item, rule=rules[rule_ids[index]].describe(table=table, index=index))
         return True
     
     '''
@@ -531,23 +690,38 @@ class Qb:
         }
         self.curl_request(api_name=api_name, data=data)
         if self.response['code'] == 200:
+            self.decisions.append({'action': 'filePrio', 'hash': torrent_hash, 'index': index, 'priority': priority})
             return True
         return False
     
     '''
-    种子内容
+    种子内容, 同一个HASH的文件列表不会变化, 优先读取缓存
     :param torrent_hash 种子HASH
     '''
     
     def torrent_content(self, torrent_hash=None):
+        content = self.content_cache.get(torrent_hash=torrent_hash, fetch=self.fetch_torrent_content)
+        if self.snapshot is not None and content is not None:
+            self.snapshot.files[torrent_hash] = content
+        return content
+
+    '''
+    从接口获取种子内容
+    :param torrent_hash 种子HASH
+    '''
+
+    def fetch_torrent_content(self, torrent_hash=None):
         api_name = '/api/v2/torrents/files'
         data = {
             'hash': torrent_hash,
         }
-        self.curl_request(api_name=api_name, data=data)
+        # 只保留选文件用到的字段
+        content = []
+        stream = JsonStream(callback=lambda path, row: content.append({'index': row['index'], 'size': row['size'], 'name': row['name']}))
+        self.curl_request(api_name=api_name, data=data, stream=stream)
         if self.response['code'] == 200:
-            return json.loads(self.response['content'])
-        return {}
+            return content
+        return None
         
     
     '''
@@ -558,42 +732,22 @@ class Qb:
     '''
  
     def get_sign_download_content_index(self, item=None, content=None):
-        category = str(item['category']).upper()
-        
-        # 拆包过滤的最小、最大文件
-        limit_min_size = Tool(number=self.torrent_split_filter_min_size).to_byte(unit='GB').value
-        limit_max_size = Tool(number=self.torrent_split_filter_max_size).to_byte(unit='GB').value
+        category_settings = self.settings.category(name=item['category'])
         
         # 下载器限制文件最大体积
         limit_size = Tool(number=int(self.limit_torrent_download_size)).to_byte(unit='GB').value
         
         # 分类限制文件最大体积
-        category_limit_size = os.getenv(category + '_LIMIT_MAX_DOWNLOAD_SIZE')
-        
-        if category_limit_size is not None:
-            limit_size = Tool(number=int(category_limit_size)).to_byte(unit='GB').value
-            
-        # 文件从小到大排序
-        content.sort(key=lambda x: x['size'])
-        
-        file = {"file_index": [], "file_content": [], "file_size": 0}
-        
-        for row in content:
-            # 最小文件/最大文件过滤
-            if limit_min_size >= row['size'] or row['size'] >= limit_max_size:
-                continue
+        if category_settings.limit_max_download_byte is not None:
+            limit_size = category_settings.limit_max_download_byte
             
-            index = str(row['index'])
-            file['file_index'].append(index)
-            file['file_content'].append(row['name'])
-            file['file_size'] = row['size']
-            break
-        
-        if file['file_size'] > limit_size:
-            file['file_index'] = []
-            file['file_content'] = []
-            file['file_size'] = 0
-        return file
+        # 拆包过滤的最小、最大文件
+        content = filter_files(content=content, filter_min_size=self.settings.torrent_split_filter_min_byte,
+                               filter_max_size=self.settings.torrent_split_filter_max_byte)
+
+        # 未设置目标体积时选最小的文件
+        return select_single_file(content=content, min_size=0, max_size=limit_size,
+                                  target=category_settings.limit_target_download_byte)
         
     '''
     返回可下载的文件序号
@@ -603,38 +757,33 @@ class Qb:
     '''
  
     def get_download_content_index(self, item=None, content=None):
-        category = str(item['category']).upper()
-        
-        # 拆包过滤的最小、最小文件
-        limit_max_size = Tool(number=self.torrent_split_filter_max_size).to_byte(unit='GB').value
-        limit_min_size = Tool(number=self.torrent_split_filter_min_size).to_byte(unit='GB').value
+        category_settings = self.settings.category(name=item['category'])
         
         # 下载器限制文件最大体积
         limit_size = Tool(number=int(self.limit_torrent_download_size)).to_byte(unit='GB').value
         
         # 分类限制文件最大体积
-        category_limit_max_size = os.getenv(category + '_LIMIT_MAX_DOWNLOAD_SIZE')
-        category_limit_min_size = os.getenv(category + '_LIMIT_MIN_DOWNLOAD_SIZE')
-        if category_limit_max_size is not None:
-            category_limit_max_size = Tool(number=int(category_limit_max_size)).to_byte(unit='GB').value
-        else:
+        category_limit_max_size = category_settings.limit_max_download_byte
+        category_limit_min_size = category_settings.limit_min_download_byte
+        if category_limit_max_size is None:
             category_limit_max_size = limit_size
             
-        if category_limit_min_size is not None:
-            category_limit_min_size = Tool(number=int(category_limit_min_size)).to_byte(unit='GB').value    
-        else:
+        if category_limit_min_size is None:
             category_limit_min_size = 20 * 1024 * 1024 * 1024
-            
-        # 文件从小到大排序
-        content.sort(key=lambda x: x['size'])
-        
+
+        # 拆包过滤的最小、最大文件
+        content = filter_files(content=content, filter_min_size=self.settings.torrent_split_filter_min_byte,
+                               filter_max_size=self.settings.torrent_split_filter_max_byte)
+
+        # 在最小、最大体积之间选最接近目标体积的一组文件, 未设置目标体积时接近最小体积
+        file = select_files(content=content, min_size=category_limit_min_size, max_size=category_limit_max_size,
+                            target=category_settings.limit_target_download_byte, budget=self.settings.split_select_budget)
+        if file is not None:
+            return file
+
+        # 没有符合的组合时从小到大选择
         file = {"file_index": [], "file_content": [], "file_size": 0}
-        
-        for row in content:
-            # 最小文件/最大文件过滤
-            if limit_min_size >= row['size'] or row['size'] >= limit_max_size:
-                continue
-            
+        for row in sorted(content, key=lambda x: x['size']):
             # 超出文件体积
             if file['file_size'] + row['size'] > category_limit_max_size:
                 break
@@ -643,10 +792,6 @@ class Qb:
             file['file_index'].append(index)
             file['file_content'].append(row['name'])
             file['file_size'] += row['size']
-            
-            # 符合下载
-            if file['file_size'] > category_limit_min_size:
-                break
            
         return file
     
@@ -654,32 +799,32 @@ class Qb:
     当前低收益的种子
     '''
     def get_lower_income_torrent(self, filter_name=None):
-        if filter_name is None:
-            filter_name = []
-        lower_income_torrent = {}
-        for item in self.torrents:
-            if item['name'] in filter_name:
-                continue
-            if item['state'] == 'pausedDL':
-                continue
-            if item['upspeed'] > 2 * 1024 * 1024:
-                continue
-            if len(lower_income_torrent) == 0:
-                lower_income_torrent = item
-                continue
-            
-            if lower_income_torrent['upspeed'] > item['upspeed']:
-                lower_income_torrent = item
-        return lower_income_torrent
+        return self.get_evict().peek(filter_name=filter_name)
+
+    '''
+    低收益种子淘汰堆, 每轮只建一次
+    '''
+    def get_evict(self):
+        if self.evict is None:
+            self.evict = Evict(torrents=self.torrents, exclude_domains=self.torrent_filter_delete_domain,
+                               exclude_hashes=[torrent_hash for torrent_hash in self.plan.actions if self.plan.has(torrent_hash=torrent_hash, action='delete')])
+        return self.evict
         
+    '''
+    还需释放的空间
+    :param download_size 下载文件的大小
+    '''
+    def need_free_space(self, download_size=None):
+        less_disk_space = Tool(number=self.less_disk_space).to_byte(unit='GB').value
+        return less_disk_space - (self.free_space + self.plan.free_space - download_size)
+
     '''
     检查剩余空间是否允许
     :param download_size 下载文件的大小
     '''
     def check_free_space_enough(self, download_size=None):
-        if self.free_space - download_size >= Tool(number=self.less_disk_space).to_byte(unit='GB').value:
-            return True
-        return False
+        # 计入本轮计划删除后释放的空间
+        return self.need_free_space(download_size=download_size) <= 0
     
     '''
     记录日志
@@ -687,35 +832,9 @@ class Qb:
     '''
     
     def log_content(self, item=None):
-        info = {}
-        if item['state'] in self.active_torrent_state:
-            info = {
-                'state': item['state'],
-                'choose_size': Tool(number=item['size']).change_byte(2).text,
-                'completed': item['completed'],
-                'completed_text': Tool(number=item['completed']).change_byte(2).text,
-                'uploaded': item['uploaded'],
-                'uploaded_text': Tool(number=item['uploaded']).change_byte(2).text,
-                'downloaded': item['downloaded'],
-                'downloaded_text': Tool(number=item['downloaded']).change_byte(2).text,
-                'progress': round(item['progress'], 2),
-                'ratio': round(item['ratio'], 2),
-                'time_active': Tool(number=item['time_active']).change_second(2).text,
-                'upspeed': item['upspeed'],
-                'upspeed_text': Tool(number=item['upspeed']).change_byte(2).text,
-                'dlspeed': item['dlspeed'],
-                'dlspeed_text': Tool(number=item['dlspeed']).change_byte(2).text,
-                'num_complete': item['num_complete'],
-                'num_incomplete': item['num_incomplete'],
-                'num_leechs': item['num_leechs'],
-            }
-    
-        # 记录种子
+        # 记录种子基本信息, 只在首次出现时写入
         file = File(dirname='torrents', category_dir=item['domain'])
-        
-        data = file.get_file(filename=item['name'] + '.json').response
-        
-        if data is None:
+        if self.replay is None and not file.exists(filename=item['name'] + '.json'):
             data = {
                 'name': item['name'],
                 'category': item['category'],
@@ -726,23 +845,55 @@ class Qb:
                 'add_time': time_format(item['added_on']),
                 'completion_time': time_format(item['completion_on']),
                 'seeding_time': Tool(number=item['seeding_time']).change_second(2).text,
-                'info': []
             }
-            
-        if len(info) > 0:   
-            data['info'].append(info)
-    
-        file.write_file(filename=item['name'] + '.json', data=data)
+            file.write_file(filename=item['name'] + '.json', data=data)
     
         return True
     
+    '''
+    当前时间, 回放时为快照录制时间
+    '''
+    def current_time(self):
+        return self.now if self.now is not None else int(time.time())
+
     '''
     CURL 请求
     :param api_name 接口地址
     :param data 数据
+    :param stream 流式解析器 (JsonStream)
+    '''
+    
+    def request(self, api_name=None, data=None, stream=None):
+        # 离线回放
+        if self.replay is not None:
+            response = self.replay.request(api_name=api_name, data=data)
+            if stream is not None and response['code'] == 200:
+                stream.feed(data=response['content'].encode('utf-8'))
+                stream.close()
+            return response
+        # 试运行不修改下载器
+        if self.dry_run and api_name in WRITE_APIS:
+            return {'code': 200, 'header': '', 'content': ''}
+        return Request(url=self.url + api_name, data=data, connect_timeout=self.connect_timeout, timeout=self.timeout).curl(cookie=self.cookie, stream=stream).response
+
+    '''
+    CURL 请求, SID 失效时自动重新登录
+    :param api_name 接口地址
+    :param data 数据
+    :param stream 流式解析器 (JsonStream), 只在返回 200 时接收内容
     '''
     
-    def curl_request(self, api_name=None, data=None):
-        self.response = Request(url=self.url + api_name, data=data).curl(cookie=self.cookie).response
+    def curl_request(self, api_name=None, data=None, stream=None):
+        metrics = get_metrics()
+        start = time.perf_counter()
+        self.response = self.request(api_name=api_name, data=data, stream=stream)
+        # SID 失效时重新登录后重试一次
+        if self.response['code'] == 403 and api_name != '/api/v2/auth/login' and self.cookie is not None:
+            metrics.inc(name='qb_api_relogin_total', labels={'qb': self.qb_name})
+            self.login()
+            if self.cookie is not None:
+                self.response = self.request(api_name=api_name, data=data, stream=stream)
+        metrics.inc(name='qb_api_calls_total', labels={'qb': self.qb_name, 'api': api_name, 'code': self.response['code']})
+        metrics.observe(name='qb_api_call_seconds', labels={'qb': self.qb_name, 'api': api_name}, value=time.perf_counter() - start)
         return self
     
@@ -0,0 +1,177 @@
+"""
+试运行快照录制与离线回放
+"""
+import gzip
+import json
+import os
+import time
+
+from tool.content import ContentCache
+from tool.file import File, remove_dir
+from tool.memo import Memo
+from tool.stats import SpeedStats
+from tool.sync import FETCH_FILTERS, Sync
+
+# 会修改下载器的接口 => 操作, 试运行时不发送
+WRITE_APIS = {
+    '/api/v2/torrents/delete': 'delete',
+    '/api/v2/torrents/pause': 'pause',
+    '/api/v2/torrents/resume': 'resume',
+    '/api/v2/torrents/reannounce': 'reannounce',
+    '/api/v2/torrents/filePrio': 'filePrio',
+}
+# 快照保存的种子字段
+TORRENT_KEYS = ['hash', 'name', 'category', 'state', 'size', 'total_size', 'completed', 'progress', 'uploaded',
+                'downloaded', 'upspeed', 'dlspeed', 'ratio', 'added_on', 'completion_on', 'seeding_time',
+                'num_incomplete', 'num_leechs']
+# 快照保存的文件字段
+FILE_KEYS = ['index', 'name', 'size']
+
+
+# 读取快照
+def load_snapshot(filename=None):
+    with gzip.open(filename, 'rt', encoding='utf-8') as f:
+        data = json.load(f)
+    torrents = [dict(zip(data['torrent_keys'], row)) for row in data['torrents']]
+    files = {}
+    for torrent_hash, rows in data['files'].items():
+        files[torrent_hash] = [dict(zip(data['file_keys'], row)) for row in rows]
+    return {'time': data['time'], 'qb_name': data['qb_name'], 'torrents': torrents, 'files': files}
+
+
+class Snapshot:
+    # 存放目录
+    dirname = 'snapshots'
+    qb_name = None
+    # 录制时间
+    time = 0
+    # 种子列表
+    torrents = []
+    # 种子HASH => 文件列表
+    files = {}
+
+    '''
+    实例化
+    :param qb_name 配置的下载器名称
+    :param torrents 本轮的种子列表
+    '''
+    def __init__(self, qb_name=None, torrents=None):
+        self.qb_name = qb_name
+        self.time = int(time.time())
+        self.torrents = torrents if torrents is not None else []
+        self.files = {}
+
+    '''
+    保存快照, 按列保存并压缩
+    '''
+    def save(self):
+        data = {
+            'time': self.time,
+            'qb_name': self.qb_name,
+            'torrent_keys': TORRENT_KEYS,
+            'torrents': [[item.get(key) for key in TORRENT_KEYS] for item in self.torrents],
+            'file_keys': FILE_KEYS,
+            'files': dict([(torrent_hash, [[row.get(key) for key in FILE_KEYS] for row in rows])
+                           for torrent_hash, rows in self.files.items()]),
+        }
+        file = File(dirname=self.dirname, category_dir=self.qb_name)
+        filename = file.dirname + '/' + time.strftime('%Y%m%d-%H%M%S', time.localtime(self.time)) + '.json.gz'
+        with gzip.open(filename, 'wt', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        return filename
+
+
+class Replay:
+    qb_name = None
+    # 快照目录
+    snapshot_dir = None
+    # 回放数据目录, 每次回放前清空
+    scratch = None
+    # 当前回放的快照
+    snapshot = None
+    # 本轮接口调用次数 接口 => 次数
+    calls = {}
+
+    '''
+    实例化
+    :param qb_name 配置的下载器名称
+    :param snapshot_dir 快照目录, 默认 snapshots/下载器名称
+    '''
+    def __init__(self, qb_name=None, snapshot_dir=None):
+        self.qb_name = qb_name
+        self.snapshot_dir = snapshot_dir if snapshot_dir is not None else File(dirname=Snapshot.dirname, category_dir=qb_name).dirname
+        self.scratch = 'replay/' + qb_name
+        self.snapshot = None
+        self.calls = {}
+
+    '''
+    模拟接口返回
+    :param api_name 接口地址
+    :param data 请求数据
+    '''
+    def request(self, api_name=None, data=None):
+        self.calls[api_name] = self.calls.get(api_name, 0) + 1
+        response = {'code': 200, 'header': '', 'content': ''}
+        if api_name == '/api/v2/sync/maindata':
+            torrents = dict([(item['hash'], item) for item in self.snapshot['torrents']])
+            response['content'] = json.dumps({'rid': self.calls[api_name], 'full_update': True, 'torrents': torrents})
+        elif api_name == '/api/v2/torrents/info':
+            data = data if data is not None else {}
+            rows = self.snapshot['torrents']
+            if data.get('hashes') is not None:
+                hashes = str(data['hashes']).split('|')
+                rows = [item for item in rows if item['hash'] in hashes]
+            if data.get('filter') is not None:
+                rows = [item for item in rows if item['state'] in FETCH_FILTERS.get(data['filter'], [])]
+            response['content'] = json.dumps(rows)
+        elif api_name == '/api/v2/torrents/files':
+            if data['hash'] not in self.snapshot['files']:
+                response['code'] = 404
+            else:
+                response['content'] = json.dumps(self.snapshot['files'][data['hash']])
+        elif api_name not in WRITE_APIS:
+            response['code'] = 404
+        return response
+
+    '''
+    按时间顺序回放所有快照
+    '''
+    def run(self):
+        # 避免循环引用
+        from tool.qb import Qb
+
+        remove_dir(dirname=File(dirname=self.scratch).dirname)
+        qb = Qb(qb_name=self.qb_name, dry_run=True)
+        qb.replay = self
+        qb.sync = Sync(qb_name=self.qb_name, active_torrent_state=qb.active_torrent_state, dirname=self.scratch + '/sync')
+        qb.content_cache = ContentCache(qb_name=self.qb_name, capacity=qb.content_cache.capacity, dirname=self.scratch + '/cache')
+        qb.memo = Memo(qb_name=self.qb_name, dirname=self.scratch + '/decisions')
+        qb.stats = SpeedStats(qb_name=self.qb_name, dirname=self.scratch + '/stats')
+        cycles = []
+        filenames = sorted([name for name in os.listdir(self.snapshot_dir) if name.endswith('.json.gz')]) \
+            if os.path.isdir(self.snapshot_dir) else []
+        for filename in filenames:
+            self.snapshot = load_snapshot(filename=self.snapshot_dir + '/' + filename)
+            self.calls = {}
+            qb.now = self.snapshot['time']
+            start = time.perf_counter()
+            qb.get_torrents().handle_torrents()
+            cycles.append({
+                'snapshot': filename,
+                'time': self.snapshot['time'],
+                'torrents': len(self.snapshot['torrents']),
+                'cycle_time': round(time.perf_counter() - start, 6),
+                'api_calls': sum(self.calls.values()),
+                'calls': self.calls,
+                'decisions': qb.decisions,
+            })
+
+        report = {
+            'qb_name': self.qb_name,
+            'cycles': cycles,
+            'total_cycle_time': round(sum([row['cycle_time'] for row in cycles]), 6),
+            'total_api_calls': sum([row['api_calls'] for row in cycles]),
+            'total_decisions': sum([len(row['decisions']) for row in cycles]),
+        }
+        File(dirname=self.scratch).write_file(filename='report.json', data=report)
+        return report
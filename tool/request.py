@@ -1,35 +1,127 @@
 """
 通用工具类封装
 """
+import threading
+import time
 from io import BytesIO
 from urllib import parse
 import pycurl
 
+from tool.metrics import get_metrics, endpoint_label
+
 
 class Request:
     url = None
     data = None
     response = {}
-    
+    # 连接池 主机 => 空闲的curl句柄
+    pool = {}
+    # 连接池锁
+    pool_lock = threading.Lock()
+    # 每个主机最多保留的空闲句柄数
+    pool_size = 4
+    # 连接超时 (秒)
+    connect_timeout = 60
+    # 请求超时 (秒)
+    timeout = 300
+    # 流式解析器
+    stream = None
+    # 返回状态码 (接收返回头时解析)
+    status = 0
+
     '''
     实例化
     :param url 接口URL
     :param data 接口数据
+    :param connect_timeout 连接超时 (秒)
+    :param timeout 请求超时 (秒)
     '''
-    def __init__(self, url=None, data=None):
+    def __init__(self, url=None, data=None, connect_timeout=None, timeout=None):
         self.url = url
         self.data = data
+        # 每个请求独立的返回数据, 多线程下互不影响
+        self.response = {}
+        if connect_timeout is not None:
+            self.connect_timeout = connect_timeout
+        if timeout is not None:
+            self.timeout = timeout
+
+    '''
+    从连接池取出句柄, 复用已建立的长连接
+    '''
+    def acquire(self):
+        host = parse.urlsplit(self.url).netloc
+        with Request.pool_lock:
+            handles = Request.pool.get(host)
+            if handles:
+                c = handles.pop()
+                c.reset()
+                return c
+        return pycurl.Curl()
+
+    '''
+    归还句柄到连接池
+    :param c curl句柄
+    '''
+    def release(self, c=None):
+        host = parse.urlsplit(self.url).netloc
+        with Request.pool_lock:
+            handles = Request.pool.setdefault(host, [])
+            if len(handles) < Request.pool_size:
+                handles.append(c)
+                return True
+        c.close()
+        return False
+
+    '''
+    逐行解析返回头, 只记录状态码和 cookie
+    :param line 返回头的一行
+    '''
+    def header_line(self, line=None):
+        line = str(line, 'ISO-8859-1').strip()
+        # 重定向或 100 Continue 时有多段返回头, 只保留最后一段
+        if line.startswith('HTTP/'):
+            self.headers = []
+            parts = line.split(' ')
+            self.status = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 0
+            self.response.pop('cookie', None)
+        elif line.lower().startswith('set-cookie:'):
+            self.response['cookie'] = line[len('set-cookie:'):].split(';')[0].strip()
+        if line != '':
+            self.headers.append(line)
+
+    '''
+    接收返回内容, 成功时边解压边交给流式解析, 不缓存整个返回内容
+    :param chunk 解压后的数据块
+    '''
+    def body_chunk(self, chunk=None):
+        self.size += len(chunk)
+        if self.stream is None or self.status != 200:
+            self.body.write(chunk)
+            return None
+        try:
+            self.stream.feed(data=chunk)
+        except Exception as e:
+            # 回调中的异常在 perform 之后抛出
+            self.error = e
+            return 0
+        return None
 
     '''
     发送curl请求
     :param cookie cookie信息
+    :param stream 流式解析器 (JsonStream), 为空时返回完整内容
     '''
 
-    def curl(self, cookie=None):
-        body_res = BytesIO()
-        herder_res = BytesIO()
+    def curl(self, cookie=None, stream=None):
+        self.body = BytesIO()
+        self.headers = []
+        self.status = 0
+        self.size = 0
+        self.stream = stream
+        self.error = None
 
-        c = pycurl.Curl()
+        c = self.acquire()
         # 设置URL
         c.setopt(pycurl.URL, self.url)
 
@@ -37,8 +129,16 @@ class Request:
         c.setopt(pycurl.MAXREDIRS, 5)
 
         # 设置超时
-        c.setopt(pycurl.CONNECTTIMEOUT, 60)
-        c.setopt(pycurl.TIMEOUT, 300)
+        c.setopt(pycurl.CONNECTTIMEOUT, self.connect_timeout)
+        c.setopt(pycurl.TIMEOUT, self.timeout)
+        # 多线程下不使用信号处理超时
+        c.setopt(pycurl.NOSIGNAL, 1)
+
+        # 保持长连接
+        c.setopt(pycurl.TCP_KEEPALIVE, 1)
+
+        # 压缩传输, 接收时自动解压
+        c.setopt(pycurl.ENCODING, 'gzip')
 
         # 设置header
         # header = ['Content-Type: text/plain; charset=UTF-8']
@@ -50,17 +150,35 @@ class Request:
         if cookie is not None:
             c.setopt(pycurl.COOKIE, cookie)
 
-        c.setopt(pycurl.HEADERFUNCTION, herder_res.write)  # 将返回的HTTP HEADER定向到回调函数getheader
+        c.setopt(pycurl.HEADERFUNCTION, self.header_line)
 
-        c.setopt(pycurl.WRITEFUNCTION, body_res.write)
+        c.setopt(pycurl.WRITEFUNCTION, self.body_chunk)
 
-        c.perform()
+        metrics = get_metrics()
+        endpoint = endpoint_label(path=parse.urlsplit(self.url).path)
+        start = time.perf_counter()
+        try:
+            c.perform()
+            self.response['code'] = c.getinfo(pycurl.HTTP_CODE)
+            # 流式解析时检查内容是否完整
+            if self.stream is not None and self.response['code'] == 200:
+                self.stream.close()
+        except (pycurl.error, ValueError):
+            # 连接异常的句柄不再复用
+            c.close()
+            metrics.inc(name='qb_http_requests_total', labels={'endpoint': endpoint, 'code': 'error'})
+            metrics.observe(name='qb_http_request_seconds', labels={'endpoint': endpoint}, value=time.perf_counter() - start)
+            if self.error is not None:
+                raise self.error
+            raise
 
-        self.response['header'] = str(herder_res.getvalue(), 'UTF-8')
-        self.response['code'] = c.getinfo(pycurl.HTTP_CODE)
-        self.response['content'] = str(body_res.getvalue(), 'UTF-8')
-        body_res.close()
-        herder_res.close()
-        c.close()
+        self.response['header'] = '\r\n'.join(self.headers)
+        self.response['content'] = str(self.body.getvalue(), 'UTF-8')
+        metrics.inc(name='qb_http_requests_total', labels={'endpoint': endpoint, 'code': self.response['code']})
+        metrics.observe(name='qb_http_request_seconds', labels={'endpoint': endpoint}, value=time.perf_counter() - start)
+        # 实际传输的字节数 (压缩后)
+        metrics.inc(name='qb_http_response_bytes_total', labels={'endpoint': endpoint}, value=c.getinfo(pycurl.SIZE_DOWNLOAD))
+        self.body.close()
+        self.release(c=c)
 
         return self
@@ -0,0 +1,222 @@
+"""
+活跃种子删种规则, 按列批量计算
+"""
+import time
+from array import array
+
+# 常用的速度/体积阈值
+KB = 1024
+MB = 1024 * 1024
+GB = 1024 * 1024 * 1024
+
+
+class Table:
+    # 数值列
+    numeric_columns = ['upspeed', 'dlspeed', 'uploaded', 'downloaded', 'size', 'total_size', 'progress',
+                       'added_on', 'completion_on', 'num_incomplete', 'num_leechs',
+                       'ewma_up_speed', 'p50_up_speed', 'p90_up_speed', 'up_span',
+                       'limit_max_download_size', 'hr_progress', 'incomplete', 'leechs']
+    # 布尔列
+    flag_columns = ['is_split_domain', 'is_black_domain', 'is_official_group', 'is_host_group', 'is_hr_group']
+    # 种子数据
+    items = []
+    # 列数据
+    columns = {}
+    # 状态编码
+    states = {}
+    # 站点编码
+    domains = {}
+
+    '''
+    实例化
+    '''
+    def __init__(self):
+        self.items = []
+        self.columns = {}
+        for name in self.numeric_columns:
+            self.columns[name] = array('d')
+        for name in self.flag_columns:
+            self.columns[name] = array('b')
+        self.columns['state'] = array('h')
+        self.columns['domain'] = array('h')
+        self.states = {}
+        self.domains = {}
+
+    def __len__(self):
+        return len(self.items)
+
+    '''
+    编码
+    :param codes 编码表
+    :param value 值
+    '''
+    def code(self, codes=None, value=None):
+        if value not in codes:
+            codes[value] = len(codes)
+        return codes[value]
+
+    '''
+    状态编码, 不存在时返回 -1
+    :param state 种子状态
+    '''
+    def state_code(self, state=None):
+        return self.states.get(state, -1)
+
+    '''
+    加入一行
+    :param item 种子数据
+    :param stats 上传速度统计 (SpeedStats), 没有时为 None
+    :param flags 布尔列的值
+    :param category_settings 分类配置
+    '''
+    def add(self, item=None, stats=None, flags=None, category_settings=None):
+        columns = self.columns
+        for name in ['upspeed', 'dlspeed', 'uploaded', 'downloaded', 'size', 'total_size', 'progress',
+                     'added_on', 'completion_on', 'num_incomplete', 'num_leechs']:
+            columns[name].append(item[name])
+        # 没有统计时为 -1
+        columns['ewma_up_speed'].append(stats['ewma'] if stats is not None else -1)
+        columns['p50_up_speed'].append(stats['p50'] if stats is not None else -1)
+        columns['p90_up_speed'].append(stats['p90'] if stats is not None else -1)
+        columns['up_span'].append(stats['span'] if stats is not None else -1)
+        # 未配置的阈值为 -1
+        for name, value in [('limit_max_download_size', category_settings.limit_max_download_byte),
+                            ('hr_progress', category_settings.hr_progress),
+                            ('incomplete', category_settings.incomplete),
+                            ('leechs', category_settings.leechs)]:
+            columns[name].append(value if value is not None else -1)
+        for name in self.flag_columns:
+            columns[name].append(1 if flags.get(name) else 0)
+        columns['state'].append(self.code(codes=self.states, value=item['state']))
+        columns['domain'].append(self.code(codes=self.domains, value=item['domain']))
+        self.items.append(item)
+        return self
+
+
+class Rule:
+    # 规则编号
+    id = 0
+    # 规则说明
+    text = None
+    # 命中后是否删除, 为 False 时命中即保留, 不再匹配后面的规则
+    delete = True
+
+    '''
+    实例化
+    :param id 规则编号
+    :param text 规则说明, 可为根据行生成说明的函数
+    :param match 匹配函数 (行号, 当前时间) => bool
+    :param delete 命中后是否删除
+    '''
+    def __init__(self, id=None, text=None, match=None, delete=True):
+        self.id = id
+        self.text = text
+        self.match = match
+        self.delete = delete
+
+    '''
+    规则说明
+    :param table 种子表
+    :param index 行号
+    '''
+    def describe(self, table=None, index=None):
+        if callable(self.text):
+            return self.text(table.columns, index)
+        return self.text
+
+
+# 真实进度
+def real_progress(c=None, i=None):
+    if c['total_size'][i] == 0:
+        return 0
+    return round(c['downloaded'][i] / c['total_size'][i], 2)
+
+
+# 规则按顺序匹配, 与原来的判断顺序一致
+def build_rules(table=None):
+    c = table.columns
+    uploading_codes = [table.state_code(state=state) for state in ['uploading', 'stalledUP']]
+    stalled_dl = table.state_code(state='stalledDL')
+    downloading = table.state_code(state='downloading')
+
+    # 等待发车
+    def waiting(i):
+        return c['state'][i] == stalled_dl and c['progress'][i] <= 0.05
+
+    # 种子添加时长
+    def age(i, now):
+        return now - c['added_on'][i]
+
+    # 上传速度统计覆盖 5 分钟以上, EWMA、最近上传速度的分位数和当前上传速度都低于阈值
+    def slow_upload(i, limit, column):
+        return c['up_span'][i] >= 5 * 60 and 0 <= c['ewma_up_speed'][i] <= limit \
+            and 0 <= c[column][i] <= limit and c['upspeed'][i] <= limit
+
+    return [
+        # 拆包后下载体积不对
+        Rule(id=1, text='错误的下载体积',
+             match=lambda i, now: c['is_split_domain'][i] and 0 <= c['limit_max_download_size'][i] < c['size'][i]),
+        # 黑种站点 3倍分享率跳车
+        Rule(id=2, text='3倍分享率跳车',
+             match=lambda i, now: c['is_black_domain'][i] and c['total_size'][i] > 0 and c['uploaded'][i] / c['total_size'][i] > 3),
+        # 黑种站点 无效做种: 超过一个小时的时候，并且上传小于32kb的种子
+        Rule(id=3, text='做种60分钟上传速度小于64KB',
+             match=lambda i, now: c['is_black_domain'][i] and c['completion_on'][i] > 0 and c['state'][i] in uploading_codes
+             and slow_upload(i, 32 * KB, 'p90_up_speed') and now - c['completion_on'][i] >= 60 * 60),
+        # 黑种站点其他种子保留
+        Rule(id=4, text='黑种站点保留', delete=False,
+             match=lambda i, now: c['is_black_domain'][i]),
+        # HR种子跳车
+        Rule(id=5, text='HR种子跳车',
+             match=lambda i, now: c['is_hr_group'][i] and c['hr_progress'][i] >= 0
+             and c['total_size'][i] * c['hr_progress'][i] - c['downloaded'][i] <= 5 * GB),
+        # 非官组 10分钟不发车
+        Rule(id=6, text='非官组, 10分钟不发车',
+             match=lambda i, now: waiting(i) and not c['is_official_group'][i] and age(i, now) > 10 * 60),
+        Rule(id=7, text='官组, 60分钟不发车',
+             match=lambda i, now: waiting(i) and age(i, now) > 1 * 60 * 60),
+        # 等待发车的种子保留
+        Rule(id=8, text='等待发车', delete=False,
+             match=lambda i, now: waiting(i)),
+        # 最近10次平均速度小于1MB, EWMA 和中位数都小于512KB
+        Rule(id=9, text='最近10次平均速度小于1MB',
+             match=lambda i, now: slow_upload(i, 512 * KB - 1, 'p50_up_speed')),
+        # 种子添加小于3分钟, 判断下载人数
+        Rule(id=10,
+             text=lambda c, i: f'真实进度{round(real_progress(c, i) * 100, 2)}%, 设置下载人数数{int(c["incomplete"][i])}, 当前种子下载人数{int(c["num_incomplete"][i])}',
+             match=lambda i, now: c['state'][i] == downloading and age(i, now) < 3 * 60 and not c['is_host_group'][i]
+             and c['incomplete'][i] >= 0 and c['num_incomplete'][i] < c['incomplete'][i]),
+        # 种子添加小于3分钟, 判断连接数
+        Rule(id=11,
+             text=lambda c, i: f'真实进度{round(real_progress(c, i) * 100, 2)}%, 设置连接数{int(c["leechs"][i])}, 当前种子连接数{int(c["num_leechs"][i])}',
+             match=lambda i, now: c['state'][i] == downloading and age(i, now) < 3 * 60 and not c['is_host_group'][i]
+             and c['leechs'][i] >= 0 and c['num_leechs'][i] < c['leechs'][i]),
+        # 种子添加超过3分钟, 不是官组、属于黑车
+        Rule(id=12, text='不是官组, 且属于黑车',
+             match=lambda i, now: c['state'][i] == downloading and age(i, now) >= 3 * 60 and not c['is_official_group'][i]
+             and c['dlspeed'][i] > 10 * MB and (c['upspeed'][i] or KB) < 512 * KB
+             and round(c['dlspeed'][i] / (c['upspeed'][i] or KB), 2) > 1.5),
+    ]
+
+
+# 批量计算, 返回是否删除及命中的规则
+def evaluate(table=None, now=None):
+    if now is None:
+        now = int(time.time())
+    total = len(table)
+    decisions = array('b', bytes(total))
+    rule_ids = array('h', [0] * total)
+    rules = build_rules(table=table)
+    pending = range(total)
+    for rule in rules:
+        remaining = []
+        for i in pending:
+            if rule.match(i, now):
+                rule_ids[i] = rule.id
+                decisions[i] = 1 if rule.delete else 0
+            else:
+                remaining.append(i)
+        pending = remaining
+        if len(pending) == 0:
+            break
+    return decisions, rule_ids, dict([(rule.id, rule) for rule in rules])
@@ -0,0 +1,76 @@
+"""
+拆包选文件, 有限次数的子集和搜索
+"""
+
+# 默认搜索次数上限
+BUDGET = 200000
+# 子集和最多保留的状态数, 体积按此精度合并
+STATES = 4096
+
+
+# 返回的文件格式
+def file_result(rows=None):
+    rows = sorted(rows, key=lambda x: x['size'])
+    return {
+        'file_index': [str(row['index']) for row in rows],
+        'file_content': [row['name'] for row in rows],
+        'file_size': sum([row['size'] for row in rows]),
+    }
+
+
+# 拆包过滤最小、最大文件
+def filter_files(content=None, filter_min_size=0, filter_max_size=0):
+    return [row for row in content if filter_min_size < row['size'] < filter_max_size]
+
+
+# 选一个体积在 [min_size, max_size] 内最接近目标的文件
+def select_single_file(content=None, min_size=0, max_size=0, target=None):
+    if target is None:
+        target = min_size
+    best = None
+    for row in content:
+        if min_size <= row['size'] <= max_size:
+            if best is None or abs(row['size'] - target) < abs(best['size'] - target):
+                best = row
+    return file_result(rows=[best] if best is not None else [])
+
+
+# 选一组体积在 [min_size, max_size] 内最接近目标的文件, 找不到时返回 None
+def select_files(content=None, min_size=0, max_size=0, target=None, budget=BUDGET):
+    if target is None:
+        target = min_size
+    target = min(max(target, min_size), max_size)
+    rows = sorted([row for row in content if row['size'] <= max_size], key=lambda x: x['size'], reverse=True)
+    if sum([row['size'] for row in rows]) < min_size:
+        return None
+
+    # 体积相近的子集只保留一个
+    unit = max(1, max_size // STATES)
+    # 合并后的体积 => (实际体积, 上一个状态, 文件序号)
+    states = {0: (0, None, None)}
+    best = None
+    iterations = 0
+    for position, row in enumerate(rows):
+        for key, (total, _, _) in list(states.items()):
+            iterations += 1
+            size = total + row['size']
+            if size > max_size:
+                continue
+            new_key = size // unit
+            if new_key in states:
+                continue
+            states[new_key] = (size, key, position)
+            if size >= min_size and (best is None or abs(size - target) < abs(states[best][0] - target)):
+                best = new_key
+        # 已经足够接近目标或超出搜索次数
+        if iterations >= budget or (best is not None and abs(states[best][0] - target) < unit):
+            break
+
+    if best is None:
+        return None
+    selected = []
+    key = best
+    while states[key][1] is not None:
+        selected.append(rows[states[key][2]])
+        key = states[key][1]
+    return file_result(rows=selected)
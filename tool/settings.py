@@ -0,0 +1,287 @@
+"""
+配置解析, 启动时解析一次
+"""
+import os
+import re
+import threading
+
+# 1GB byte 字节
+GB = 1024 * 1024 * 1024
+
+# 分类配置的后缀, 长的在前
+CATEGORY_KEYS = ['LIMIT_TARGET_DOWNLOAD_SIZE', 'LIMIT_MAX_DOWNLOAD_SIZE', 'LIMIT_MIN_DOWNLOAD_SIZE', 'LIMIT_MIN_CHOOSE_SIZE', 'SPLIT_SINGLE_FILE',
+                 'HR_PROGRESS', 'HR_GROUP', 'INCOMPLETE', 'LEECHS', 'DOMAIN', 'GROUP']
+# 全局配置, 不属于分类
+GLOBAL_KEYS = ['HR_DOMAIN', 'TORRENT_SPLIT_DOMAIN', 'BLACK_TORRENT_DOMAIN', 'TORRENT_FILTER_DELETE_DOMAIN', 'ALL_GROUP']
+
+settings = None
+settings_lock = threading.Lock()
+
+
+# 获取配置
+def get_settings():
+    global settings
+    with settings_lock:
+        if settings is None:
+            settings = Settings()
+        return settings
+
+
+# 重新读取配置
+def reload_settings():
+    global settings
+    with settings_lock:
+        settings = Settings()
+        return settings
+
+
+# 读取字符串配置, 空值视为未配置
+def env_str(key=None, default=None):
+    value = os.getenv(key)
+    if value is None or value.strip() == '':
+        return default
+    return value.strip()
+
+
+# 读取整数配置
+def env_int(key=None, default=None):
+    value = env_str(key=key)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f'配置 {key} 必须是整数, 当前值: {value}')
+
+
+# 读取小数配置
+def env_float(key=None, default=None):
+    value = env_str(key=key)
+    if value is None:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f'配置 {key} 必须是数字, 当前值: {value}')
+
+
+# 读取逗号分隔的配置
+def env_set(key=None, default=None):
+    value = env_str(key=key)
+    if value is None:
+        return default
+    return frozenset([row.strip() for row in value.split(',') if row.strip() != ''])
+
+
+# GB 转换 byte 字节
+def gb_to_byte(number=None):
+    if number is None:
+        return None
+    return int(number * GB)
+
+
+class CategorySettings:
+    # 分类名称 (大写)
+    name = None
+    # 站点域名
+    domain = None
+    # 站点官组
+    group = frozenset()
+    # HR官组
+    hr_group = None
+    # HR跳车进度 (0-1)
+    hr_progress = None
+    # 下载人数
+    incomplete = None
+    # 连接数
+    leechs = None
+    # 最大下载体积 (GB) 及 byte 字节
+    limit_max_download_size = None
+    limit_max_download_byte = None
+    # 最小下载体积 (GB) 及 byte 字节
+    limit_min_download_size = None
+    limit_min_download_byte = None
+    # 拆包目标下载体积 (GB) 及 byte 字节
+    limit_target_download_size = None
+    limit_target_download_byte = None
+    # 最小入种体积 (GB) 及 byte 字节
+    limit_min_choose_size = None
+    limit_min_choose_byte = None
+    # 单文件拆包
+    split_single_file = False
+
+    '''
+    实例化
+    :param name 分类名称
+    '''
+    def __init__(self, name=None):
+        self.name = str(name).upper()
+        self.domain = env_str(key=self.name + '_DOMAIN')
+        self.group = env_set(key=self.name + '_GROUP', default=frozenset())
+        self.hr_group = env_set(key=self.name + '_HR_GROUP')
+        hr_progress = env_int(key=self.name + '_HR_PROGRESS')
+        self.hr_progress = hr_progress / 100 if hr_progress is not None else None
+        self.incomplete = env_int(key=self.name + '_INCOMPLETE')
+        self.leechs = env_int(key=self.name + '_LEECHS')
+        self.limit_max_download_size = env_int(key=self.name + '_LIMIT_MAX_DOWNLOAD_SIZE')
+        self.limit_max_download_byte = gb_to_byte(self.limit_max_download_size)
+        self.limit_min_download_size = env_int(key=self.name + '_LIMIT_MIN_DOWNLOAD_SIZE')
+        self.limit_min_download_byte = gb_to_byte(self.limit_min_download_size)
+        self.limit_target_download_size = env_int(key=self.name + '_LIMIT_TARGET_DOWNLOAD_SIZE')
+        self.limit_target_download_byte = gb_to_byte(self.limit_target_download_size)
+        self.limit_min_choose_size = env_int(key=self.name + '_LIMIT_MIN_CHOOSE_SIZE')
+        self.limit_min_choose_byte = gb_to_byte(self.limit_min_choose_size)
+        self.split_single_file = env_str(key=self.name + '_SPLIT_SINGLE_FILE') is not None
+
+
+class DownloaderSettings:
+    # 下载器名称
+    name = None
+    url = None
+    username = None
+    password = None
+    # 磁盘总空间 (GB)
+    disk_space = 0
+    # 最小预留磁盘空间 (GB)
+    less_disk_space = 0
+    # 限制活跃种子数
+    limit_active_torrent_num = 0
+    # 选种大小 (GB)
+    limit_torrent_download_size = 0
+    # 连接超时/请求超时 (秒)
+    connect_timeout = 60
+    timeout = 300
+    # 获取种子方式 sync 增量同步 / filter 按状态获取
+    fetch_mode = 'sync'
+    # 按状态获取时, 每隔几轮获取一次全部种子 (含做种)
+    full_fetch_interval = 10
+    # 常驻模式下种子表、速度统计、选种决策最短保存间隔 (秒)
+    save_interval = 600
+    # 常驻模式下执行间隔 (秒)
+    interval = 60
+
+    '''
+    实例化
+    :param name 下载器名称
+    '''
+    def __init__(self, name=None):
+        self.name = name
+        self.url = env_str(key=name + '_URL')
+        self.username = os.getenv(name + '_USERNAME')
+        self.password = os.getenv(name + '_PASSWORD')
+        self.disk_space = env_int(key=name + '_DISK_SPACE', default=0)
+        self.less_disk_space = env_int(key=name + '_LESS_DOSK_SPACE', default=0)
+        self.limit_active_torrent_num = env_int(key=name + '_LIMIT_ACTIVE_TORRENT_NUM', default=0)
+        self.limit_torrent_download_size = env_int(key=name + '_LIMIT_TORRENT_DOWNLOAD_SIZE', default=0)
+        self.connect_timeout = env_int(key=name + '_CONNECT_TIMEOUT', default=60)
+        self.timeout = env_int(key=name + '_TIMEOUT', default=300)
+        self.fetch_mode = env_str(key=name + '_FETCH_MODE', default='sync')
+        if self.fetch_mode not in ['sync', 'filter']:
+            raise ValueError(f'配置 {name}_FETCH_MODE 只能是 sync 或 filter, 当前值: {self.fetch_mode}')
+        self.full_fetch_interval = max(env_int(key=name + '_FULL_FETCH_INTERVAL', default=10), 1)
+        self.save_interval = max(env_int(key=name + '_SAVE_INTERVAL', default=600), 0)
+        self.interval = env_int(key=name + '_INTERVAL', default=60)
+
+
+class Settings:
+    # 拆包过滤最大/最小文件 (GB)
+    torrent_split_filter_max_size = 0
+    torrent_split_filter_min_size = 0
+    torrent_split_filter_max_byte = 0
+    torrent_split_filter_min_byte = 0
+    # 拆包的站点
+    torrent_split_domain = frozenset()
+    # 黑种站点
+    black_torrent_domain = frozenset()
+    # HR站点
+    hr_domain = frozenset()
+    # HR选种大小 (GB) 及 byte 字节
+    hr_limit_size = 0
+    hr_limit_byte = 0
+    # 所有官组
+    all_group = frozenset()
+    # 排除不删种的站点
+    torrent_filter_delete_domain = frozenset()
+    # TG 接口地址
+    tg_api_url = 'https://api.telegram.org'
+    # 拆包选文件的搜索次数上限
+    split_select_budget = 200000
+    # 内存中缓存文件列表的种子数
+    content_cache_size = 1000
+    # 统计监控解析删种事件的进程数, 1 为单进程
+    monitor_workers = 1
+    # 统计监控排名数量
+    monitor_top_n = 5
+    # 常驻模式下统计监控间隔 (秒), 0 不执行
+    monitor_interval = 3600
+    # 常驻模式下并发线程数, 0 为下载器数+1
+    daemon_workers = 0
+    # 指标 textfile 路径, 为空不写入
+    metrics_textfile = None
+    # 指标 HTTP 端口, 0 不启动
+    metrics_port = 0
+    # 分类配置
+    categories = {}
+    # 下载器配置
+    downloaders = {}
+
+    '''
+    实例化, 解析并校验所有配置
+    '''
+    def __init__(self):
+        self.torrent_split_filter_max_size = env_float(key='TORRENT_SPLIT_FILTER_MAX_SIZE', default=0)
+        self.torrent_split_filter_min_size = env_float(key='TORRENT_SPLIT_FILTER_MIN_SIZE', default=0)
+        self.torrent_split_filter_max_byte = gb_to_byte(self.torrent_split_filter_max_size)
+        self.torrent_split_filter_min_byte = gb_to_byte(self.torrent_split_filter_min_size)
+        self.torrent_split_domain = env_set(key='TORRENT_SPLIT_DOMAIN', default=frozenset())
+        self.black_torrent_domain = env_set(key='BLACK_TORRENT_DOMAIN', default=frozenset())
+        self.hr_domain = env_set(key='HR_DOMAIN', default=frozenset())
+        self.hr_limit_size = env_int(key='HR_LIMIT_MIN_CHOOSE_SIZE', default=0)
+        self.hr_limit_byte = gb_to_byte(self.hr_limit_size)
+        self.all_group = env_set(key='ALL_GROUP', default=frozenset())
+        self.torrent_filter_delete_domain = env_set(key='TORRENT_FILTER_DELETE_DOMAIN', default=frozenset())
+        self.tg_api_url = env_str(key='TG_API_URL', default='https://api.telegram.org').rstrip('/')
+        self.split_select_budget = env_int(key='SPLIT_SELECT_BUDGET', default=200000)
+        self.content_cache_size = env_int(key='CONTENT_CACHE_SIZE', default=1000)
+        # 0 为 CPU 核数
+        self.monitor_workers = env_int(key='MONITOR_WORKERS', default=1) or os.cpu_count() or 1
+        self.monitor_top_n = env_int(key='MONITOR_TOP_N', default=5)
+        self.monitor_interval = env_int(key='MONITOR_INTERVAL', default=3600)
+        self.daemon_workers = env_int(key='DAEMON_WORKERS', default=0)
+        self.metrics_textfile = env_str(key='METRICS_TEXTFILE')
+        self.metrics_port = env_int(key='METRICS_PORT', default=0)
+
+        self.categories = {}
+        pattern = re.compile(r'^(.+?)_(' + '|'.join(CATEGORY_KEYS) + r')$')
+        for key in os.environ:
+            match = pattern.match(key)
+            if match is None or key in GLOBAL_KEYS or match.group(1) in GLOBAL_KEYS:
+                continue
+            self.category(name=match.group(1))
+
+        self.downloaders = {}
+        for name in env_set(key='ALL_DOWNLOADERS', default=frozenset()):
+            self.downloaders[name] = DownloaderSettings(name=name)
+
+    '''
+    分类配置
+    :param name 分类名称
+    '''
+    def category(self, name=None):
+        name = str(name).upper()
+        category = self.categories.get(name)
+        if category is None:
+            category = CategorySettings(name=name)
+            self.categories[name] = category
+        return category
+
+    '''
+    下载器配置
+    :param name 下载器名称
+    '''
+    def downloader(self, name=None):
+        downloader = self.downloaders.get(name)
+        if downloader is None:
+            downloader = DownloaderSettings(name=name)
+            self.downloaders[name] = downloader
+        return downloader
@@ -0,0 +1,115 @@
+"""
+种子上传速度的流式统计, 每个种子只保留固定大小的状态
+"""
+import json
+import time
+
+from tool.file import File
+
+# EWMA 半衰期 (秒)
+HALF_LIFE = 150
+# 分位数统计的最近采样数
+WINDOW = 10
+
+
+# 分位数
+def percentile(values=None, p=0.5):
+    rows = sorted(values)
+    return rows[min(len(rows) - 1, int(p * len(rows)))]
+
+
+class SpeedStats:
+    qb_name = None
+    # 种子HASH => [首次采样时间, 上次采样时间, 上次已上传, EWMA, 最近上传速度]
+    records = {}
+    # 是否有未保存的修改
+    dirty = False
+    # 上次保存时间
+    saved_at = 0
+    # 最短保存间隔 (秒), 单次运行时每次都保存
+    save_interval = 600
+
+    '''
+    实例化
+    :param qb_name 配置的下载器名称
+    :param dirname 保存目录
+    :param save_interval 最短保存间隔 (秒)
+    '''
+    def __init__(self, qb_name=None, dirname='stats', save_interval=None):
+        self.qb_name = qb_name
+        if save_interval is not None:
+            self.save_interval = save_interval
+        self.file = File(dirname=dirname)
+        data = self.file.get_file(filename=self.qb_name + '.json').response
+        self.records = data.get('records', {}) if data is not None else {}
+        self.dirty = False
+
+    '''
+    追加一次采样, 上传速度按两次采样间的已上传增量计算
+    :param item 种子数据
+    :param sample_time 采样时间
+    '''
+    def update(self, item=None, sample_time=None):
+        record = self.records.get(item['hash'])
+        uploaded = item['uploaded']
+        if record is None:
+            # 首次采样没有增量, 先用当前上传速度
+            record = [sample_time, sample_time, uploaded, item['upspeed'], [item['upspeed']]]
+            self.records[item['hash']] = record
+            self.dirty = True
+        elif sample_time > record[1]:
+            seconds = sample_time - record[1]
+            # 已上传变小时 (重新添加的种子) 用当前上传速度
+            rate = int((uploaded - record[2]) / seconds) if uploaded >= record[2] else item['upspeed']
+            alpha = 1 - 0.5 ** (seconds / HALF_LIFE)
+            record[1] = sample_time
+            record[2] = uploaded
+            record[3] = int(record[3] + alpha * (rate - record[3]))
+            record[4] = (record[4] + [rate])[-WINDOW:]
+            self.dirty = True
+        return self.view(record=record)
+
+    '''
+    统计结果
+    :param record 统计状态
+    '''
+    def view(self, record=None):
+        return {
+            # 统计覆盖的时长 (秒)
+            'span': record[1] - record[0],
+            'ewma': record[3],
+            'rate': record[4][-1],
+            'p50': percentile(values=record[4], p=0.5),
+            'p90': percentile(values=record[4], p=0.9),
+        }
+
+    '''
+    读取统计结果, 没有采样时返回 None
+    :param torrent_hash 种子HASH
+    '''
+    def get(self, torrent_hash=None):
+        record = self.records.get(torrent_hash)
+        return self.view(record=record) if record is not None else None
+
+    '''
+    清理已不存在的种子
+    :param hashes 当前所有种子HASH
+    '''
+    def prune(self, hashes=None):
+        for torrent_hash in [row for row in self.records if row not in hashes]:
+            del self.records[torrent_hash]
+            self.dirty = True
+        return self
+
+    '''
+    写入文件, 没有修改或距上次保存不到最短间隔时不保存
+    :param force 是否忽略保存间隔
+    '''
+    def save(self, force=False):
+        now = time.time()
+        if not self.dirty or (not force and now - self.saved_at < self.save_interval):
+            return self
+        self.file.write_file(filename=self.qb_name + '.json', data=json.dumps({'records': self.records}, separators=(',', ':')))
+        self.dirty = False
+        self.saved_at = now
+        return self
@@ -0,0 +1,140 @@
+"""
+增量 JSON 解析, 边接收边解析, 每解析出一条记录回调一次
+"""
+import codecs
+import json
+
+# 空白字符
+WHITESPACE = ' \t\r\n'
+
+
+class JsonStream:
+    # 需要逐条解析的顶层字段, 例如 sync/maindata 的 torrents
+    expand = frozenset()
+    # 是否解析完成
+    done = False
+
+    '''
+    实例化
+    :param callback 回调 (路径, 值), 顶层数组的路径为 (序号,), 顶层对象为 (字段,), 展开的字段为 (字段, 子字段/序号)
+    :param expand 需要逐条解析的顶层字段
+    '''
+    def __init__(self, callback=None, expand=None):
+        self.callback = callback
+        self.expand = frozenset(expand if expand is not None else [])
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        # 解析中的容器 [类型, 路径, 状态, 序号, 字段]
+        self.stack = []
+        self.done = False
+
+    '''
+    接收数据
+    :param data 字节数据
+    '''
+    def feed(self, data=None):
+        self.buffer = self.buffer[self.pos:] + self.text_decoder.decode(data)
+        self.pos = 0
+        self.parse(final=False)
+        return len(data)
+
+    '''
+    数据接收完成
+    '''
+    def close(self):
+        self.buffer = self.buffer[self.pos:] + self.text_decoder.decode(b'', final=True)
+        self.pos = 0
+        self.parse(final=True)
+        if not self.done:
+            raise ValueError('JSON 数据不完整')
+        return self
+
+    '''
+    跳过空白字符
+    '''
+    def skip(self):
+        while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+            self.pos += 1
+        return self.pos < len(self.buffer)
+
+    '''
+    解析一个完整的值, 数据不够时返回 None
+    :param final 是否已接收完
+    '''
+    def decode(self, final=False):
+        try:
+            value, end = self.decoder.raw_decode(self.buffer, self.pos)
+        except ValueError:
+            if final:
+                raise
+            return None
+        # 数字可能还没接收完
+        if end >= len(self.buffer) and not final:
+            return None
+        self.pos = end
+        return (value,)
+
+    '''
+    解析缓冲区中已完整的记录
+    :param final 是否已接收完
+    '''
+    def parse(self, final=False):
+        while not self.done and self.skip():
+            char = self.buffer[self.pos]
+            if len(self.stack) == 0:
+                if char not in '[{':
+                    raise ValueError('只支持顶层为数组或对象的 JSON')
+                self.stack.append(['array' if char == '[' else 'object', (), 'first', 0, None])
+                self.pos += 1
+                continue
+
+            frame = self.stack[-1]
+            kind, path, state = frame[0], frame[1], frame[2]
+            if state in ['first', 'next']:
+                if char == (']' if kind == 'array' else '}'):
+                    self.pos += 1
+                    self.stack.pop()
+                    if len(self.stack) == 0:
+                        self.done = True
+                    continue
+                if state == 'next':
+                    if char != ',':
+                        raise ValueError(f'JSON 格式错误, 位置 {self.pos}')
+                    self.pos += 1
+                frame[2] = 'key' if kind == 'object' else 'value'
+                continue
+
+            if state == 'key':
+                if char != '"':
+                    raise ValueError(f'JSON 格式错误, 位置 {self.pos}')
+                start = self.pos
+                # 字段名可能还没接收完, 等待更多数据
+                key = self.decode(final=final)
+                if key is None or not self.skip():
+                    self.pos = start
+                    return self
+                if self.buffer[self.pos] != ':':
+                    raise ValueError(f'JSON 格式错误, 位置 {self.pos}')
+                self.pos += 1
+                frame[4] = key[0]
+                frame[2] = 'value'
+                continue
+
+            # 值
+            name = frame[4] if kind == 'object' else frame[3]
+            frame[3] += 1
+            if len(self.stack) == 1 and kind == 'object' and name in self.expand and char in '[{':
+                frame[2] = 'next'
+                self.stack.append(['array' if char == '[' else 'object', path + (name,), 'first', 0, None])
+                self.pos += 1
+                continue
+
+            value = self.decode(final=final)
+            if value is None:
+                frame[3] -= 1
+                return self
+            frame[2] = 'next'
+            self.callback(path + (name,), value[0])
+        return self
@@ -0,0 +1,250 @@
+"""
+种子增量同步 (/api/v2/sync/maindata)
+"""
+import json
+import time
+
+from tool.file import File
+from tool.settings import get_settings
+from tool.torrent import FIELDS, TorrentRow
+
+# /api/v2/torrents/info 的 filter => 包含的种子状态
+FETCH_FILTERS = {
+    'downloading': ['downloading', 'metaDL', 'forcedMetaDL', 'stalledDL', 'checkingDL', 'pausedDL', 'stoppedDL',
+                    'queuedDL', 'forcedDL', 'allocating'],
+    'errored': ['error', 'missingFiles'],
+}
+
+
+class Sync:
+    qb_name = None
+    # 同步序号
+    rid = 0
+    # 按状态获取时的轮次
+    cycle = 0
+    # 种子表 hash => 种子数据 (TorrentRow)
+    torrents = {}
+    # 服务器状态
+    server_state = {}
+    # 本次返回的种子HASH
+    seen = set()
+    # 本次返回的同步序号, 完整接收后才生效
+    next_rid = None
+    # 本轮获取到最新数据的种子HASH, None 为全部种子
+    fresh = None
+    # 种子表是否有未保存的修改
+    dirty = False
+    # 上次保存时间
+    saved_at = 0
+    # 最短保存间隔 (秒), 单次运行时每次都保存
+    save_interval = 600
+    # 活跃种子状态集合
+    active_torrent_state = []
+    # 所有种子数
+    total_torrent_num = 0
+    # 暂停种子数
+    pause_torrent_num = 0
+    # 当前活跃种子数
+    active_torrent_num = 0
+    # 已选择文件下载总空间大小  byte 字节
+    total_download_choose_file_size = 0
+
+    '''
+    实例化
+    :param qb_name 配置的下载器名称
+    :param active_torrent_state 活跃种子状态集合
+    :param dirname 保存目录
+    :param save_interval 最短保存间隔 (秒)
+    '''
+    def __init__(self, qb_name=None, active_torrent_state=None, dirname='sync', save_interval=None):
+        self.qb_name = qb_name
+        if save_interval is not None:
+            self.save_interval = save_interval
+        self.torrents = {}
+        self.server_state = {}
+        self.seen = set()
+        self.active_torrent_state = active_torrent_state if active_torrent_state is not None else []
+        self.file = File(dirname=dirname)
+        self.load()
+
+    '''
+    读取上次同步的状态
+    '''
+    def load(self):
+        data = self.file.get_file(filename=self.qb_name + '.json').response
+        if data is None:
+            return self
+        self.rid = data.get('rid', 0)
+        self.cycle = data.get('cycle', 0)
+        self.server_state = data.get('server_state', {})
+        fields = data.get('fields', FIELDS)
+        for values in data.get('torrents', []):
+            row = dict(zip(fields, values))
+            self.upsert(torrent_hash=row['hash'], row=row)
+        self.dirty = False
+        return self
+
+    '''
+    保存同步状态, 种子表没有修改或距上次保存不到最短间隔时不保存
+    :param force 是否忽略保存间隔
+    '''
+    def save(self, force=False):
+        now = time.time()
+        if not self.dirty or (not force and now - self.saved_at < self.save_interval):
+            return self
+        data = {
+            'rid': self.rid,
+            'cycle': self.cycle,
+            'server_state': self.server_state,
+            # 按列名保存, 每个种子只保存值
+            'fields': list(FIELDS),
+            'torrents': [[getattr(item, key) for key in FIELDS] for item in self.torrents.values()],
+        }
+        self.file.write_file(filename=self.qb_name + '.json', data=json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+        self.dirty = False
+        self.saved_at = now
+        return self
+
+    '''
+    清空种子表
+    '''
+    def reset(self):
+        self.dirty = True
+        self.torrents = {}
+        self.server_state = {}
+        self.total_torrent_num = 0
+        self.pause_torrent_num = 0
+        self.active_torrent_num = 0
+        self.total_download_choose_file_size = 0
+        return self
+
+    '''
+    开始接收一次返回内容
+    '''
+    def begin(self):
+        self.seen = set()
+        self.next_rid = None
+        return self
+
+    '''
+    返回内容完整接收后更新同步序号, 接收失败时从头全量同步
+    :param success 是否完整接收
+    '''
+    def commit(self, success=True):
+        if not success:
+            self.rid = 0
+        elif self.next_rid is not None:
+            self.rid = self.next_rid
+        self.next_rid = None
+        return self
+
+    '''
+    接收 sync/maindata 返回内容的一个字段或一个种子, 只应用增量数据, full_update 时全量重建
+    :param path 字段路径, 种子为 ('torrents', 种子HASH)
+    :param value 字段值
+    '''
+    def feed(self, path=None, value=None):
+        if path[0] == 'torrents' and len(path) == 2:
+            self.upsert(torrent_hash=path[1], row=value)
+            self.seen.add(path[1])
+        elif path[0] == 'full_update' and value:
+            # 一般先于 torrents 返回, 否则只保留本次返回的种子
+            if len(self.seen) == 0:
+                self.reset()
+            else:
+                for torrent_hash in [row for row in self.torrents if row not in self.seen]:
+                    self.remove(torrent_hash=torrent_hash)
+        elif path[0] == 'torrents_removed':
+            for torrent_hash in value:
+                self.remove(torrent_hash=torrent_hash)
+        elif path[0] == 'server_state':
+            self.server_state.update(value)
+        elif path[0] == 'rid':
+            self.next_rid = value
+        return self
+
+    '''
+    接收 /api/v2/torrents/info 返回的一个种子
+    :param path 序号
+    :param value 种子数据
+    '''
+    def feed_row(self, path=None, value=None):
+        self.upsert(torrent_hash=value['hash'], row=value)
+        self.seen.add(value['hash'])
+        if self.fresh is not None:
+            self.fresh.add(value['hash'])
+        return self
+
+    '''
+    种子数据是否为本轮获取的最新数据
+    :param torrent_hash 种子HASH
+    '''
+    def is_fresh(self, torrent_hash=None):
+        return self.fresh is None or torrent_hash in self.fresh
+
+    '''
+    合并按状态获取的种子列表 (已通过 feed_row 接收)
+    :param states 本次获取覆盖的种子状态, 为空时为全部种子
+    '''
+    def merge(self, states=None):
+        # 全量获取时没返回的种子已删除
+        if states is None:
+            for torrent_hash in [row for row in self.torrents if row not in self.seen]:
+                self.remove(torrent_hash=torrent_hash)
+            return []
+
+        # 原来属于这些状态但没返回的种子, 状态已变化或已删除
+        return [torrent_hash for torrent_hash, item in self.torrents.items() if item.get('state') in states and torrent_hash not in self.seen]
+
+    '''
+    新增/更新种子
+    :param torrent_hash 种子HASH
+    :param row 种子数据(可为部分字段)
+    '''
+    def upsert(self, torrent_hash=None, row=None):
+        self.dirty = True
+        item = self.torrents.get(torrent_hash)
+        if item is None:
+            item = TorrentRow(torrent_hash=torrent_hash)
+            self.torrents[torrent_hash] = item
+            self.total_torrent_num += 1
+        else:
+            self.count(item=item, step=-1)
+
+        item.update(row=row)
+        if 'category' in row or item['domain'] is None:
+            # 解析域名
+            item['domain'] = get_settings().category(name=item.get('category')).domain
+        self.count(item=item, step=1)
+        return item
+
+    '''
+    删除种子
+    :param torrent_hash 种子HASH
+    '''
+    def remove(self, torrent_hash=None):
+        item = self.torrents.pop(torrent_hash, None)
+        if item is not None:
+            self.dirty = True
+            self.count(item=item, step=-1)
+            self.total_torrent_num -= 1
+        return item
+
+    '''
+    计数器增减
+    :param item 种子数据
+    :param step 1 计入 / -1 移除
+    '''
+    def count(self, item=None, step=1):
+        state = item.get('state')
+        # 所有活跃种子
+        if state in self.active_torrent_state:
+            self.total_download_choose_file_size += item.get('size', 0) * step
+
+        # 下载/上传活跃种子数
+        if state in ['uploading', 'downloading']:
+            self.active_torrent_num += step
+
+        # 暂停种子数
+        if state in ['pausedDL']:
+            self.pause_torrent_num += step
@@ -1,12 +1,12 @@
 """
 通用工具类封装
 """
-import os
+import json
 import re
 import time
 
 from tool.file import File
-from tool.request import Request
+from tool.notify import get_notify
 
 
 class Tool:
@@ -140,18 +140,31 @@ class Tool:
                f"站点域名: {item['domain']}\r\n" \
                f"删种规则: {rule}\r\n"
 
-        file = File(dirname="logs", category_dir=item['domain'])
-        filename = time.strftime("%Y-%m-%d", time.localtime()) + '.log'
-        data = file.get_file(filename=filename).response
-        if data is None:
-            data = '==========================\r\n' + text
-        else:
-            data += '==========================\r\n' + text
-        file.write_file(filename=filename, data=data)
-        api_url = 'https://api.telegram.org/bot' + os.getenv(self.qb_name + '_TG_TOKEN') + '/sendMessage'
-        data = {
-            'chat_id': os.getenv(self.qb_name + '_TG_CHAT_ID'),
-            'text': text,
+        # 删种事件, 记录原始字节数
+        event = {
+            'time': int(time.time()),
+            'date': time.strftime("%Y-%m-%d", time.localtime()),
+            'downloader': self.qb_name,
+            'hash': item['hash'],
+            'name': item['name'],
+            'category': item['category'],
+            'domain': item['domain'],
+            'state': item['state'],
+            'total_size': item['total_size'],
+            'size': item['size'],
+            'completed': item['completed'],
+            'uploaded': item['uploaded'],
+            'downloaded': item['downloaded'],
+            'upspeed': item['upspeed'],
+            'dlspeed': item['dlspeed'],
+            'ratio': item['ratio'],
+            'progress': item['progress'],
+            'added_on': item['added_on'],
+            'rule': rule,
         }
-        Request(url=api_url, data=data).curl()
+        # 没有站点域名的种子归到 unknown 目录, 统计监控只扫描分类目录
+        file = File(dirname="events", category_dir=item['domain'] if item['domain'] else 'unknown')
+        file.append_file(filename=event['date'] + '.jsonl', data=json.dumps(event, ensure_ascii=False) + '\n')
+        # 后台队列合并发送, 不阻塞删种
+        get_notify().push(qb_name=self.qb_name, text=text)
     
\ No newline at end of file
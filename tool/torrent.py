@@ -0,0 +1,68 @@
+"""
+种子数据, 只保留规则和日志用到的字段
+"""
+import sys
+
+# 保留的字段
+FIELDS = ('hash', 'name', 'category', 'domain', 'state', 'size', 'total_size', 'completed', 'progress', 'uploaded',
+          'downloaded', 'upspeed', 'dlspeed', 'ratio', 'added_on', 'completion_on', 'seeding_time',
+          'num_incomplete', 'num_leechs')
+FIELD_SET = frozenset(FIELDS)
+# 重复值很多的字段, 驻留后所有种子共用同一个字符串
+INTERN_FIELDS = frozenset(['category', 'domain', 'state'])
+# 文本字段, 其余字段默认为 0
+TEXT_FIELDS = frozenset(['hash', 'name', 'category', 'domain', 'state'])
+
+
+class TorrentRow:
+    __slots__ = FIELDS
+
+    '''
+    实例化
+    :param torrent_hash 种子HASH
+    '''
+    def __init__(self, torrent_hash=None):
+        for key in FIELDS:
+            setattr(self, key, None if key in TEXT_FIELDS else 0)
+        self.hash = torrent_hash
+
+    def __getitem__(self, key):
+        if key not in FIELD_SET:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in FIELD_SET:
+            raise KeyError(key)
+        if key in INTERN_FIELDS and isinstance(value, str):
+            value = sys.intern(value)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in FIELD_SET
+
+    '''
+    读取字段
+    :param key 字段
+    :param default 默认值
+    '''
+    def get(self, key=None, default=None):
+        if key not in FIELD_SET:
+            return default
+        return getattr(self, key)
+
+    '''
+    更新字段, 忽略不保留的字段
+    :param row 种子数据(可为部分字段)
+    '''
+    def update(self, row=None):
+        for key, value in row.items():
+            if key in FIELD_SET:
+                self[key] = value
+        return self
+
+    '''
+    转换成字典保存
+    '''
+    def to_dict(self):
+        return dict([(key, getattr(self, key)) for key in FIELDS])